@@ -0,0 +1,179 @@
+"""
+数值计算部分的性能基准测试
+
+对滤波、积分、合成、烈度计算、滑动最大值和CSV读取等函数，在从一次刷新（100个采样）到数小时（10^7个采样）的数据上
+分别测量耗时和峰值内存，结果可保存为JSON，并与以前版本的结果比较，找出变慢的部分
+
+用法：
+python benchmark.py -o before.json
+python benchmark.py "logs/xxx/Raw Data.csv" --max-size 1000000 --compare before.json
+"""
+import argparse
+import json
+import platform
+import tracemalloc
+from os import path as os_path
+from tempfile import TemporaryDirectory
+from time import perf_counter, strftime, gmtime
+
+import numpy as np
+import scipy
+
+import main
+from phyphox_stub import synthetic_data
+
+SIZES = [100, 10000, 1000000, 10000000]
+
+
+def make_acc(size, base):
+    """将三方向加速度base(3, M)循环拼接为(3, size)"""
+    return np.ascontiguousarray(base[:, np.arange(size) % base.shape[1]])
+
+
+def write_raw_csv(file_path, acc, fs):
+    """按本程序记录的格式写入Raw Data.csv"""
+    t = np.arange(acc.shape[1]) / fs
+    rows = np.vstack((t, acc, np.sqrt((acc ** 2).sum(axis=0)))).T
+    np.savetxt(file_path, rows, delimiter=',', fmt='%.15g', header=','.join(main.RAW_DATA_HEADER), comments='')
+
+
+def kernels(acc, fs, folder):
+    '''
+    生成各个待测函数，每项为(名称, 无参数的可调用对象)\\
+    准备工作（积分、写入CSV等）在这里完成，不计入耗时
+    '''
+    dt = 1 / fs
+    size = acc.shape[1]
+    t = np.arange(size) * dt
+    waves = main.integrate(acc, dt)
+    filtered = main.filter_wave(waves, dt=dt)
+    resultants = main.resultant(filtered)
+    yield 'integrate', lambda: main.integrate(acc, dt)
+    yield 'filter_wave', lambda waves=waves: main.filter_wave(waves, dt=dt)  # 绑定为默认参数：下面del之后仍可调用
+    yield 'stream_filter', lambda: main.StreamFilter(dt=dt).process(acc)
+    yield 'resultant', lambda: main.resultant(filtered)
+    yield 'process_wave', lambda: main.process_wave(acc, fs, (0.0, 0.0, 0.0))
+    yield 'csis_calc', lambda: main.csis_calc(resultants[0].max(), resultants[1].max(), True)
+    yield 'jma_calc', lambda: main.jma_calc(main.jma_acc(acc, fs))
+    yield 'window_max', lambda: main.WindowMax(size).update(resultants[0], t)
+    del waves  # 测量完filter_wave后即可释放，不与下面的CSV一同占用内存
+    if folder is not None:
+        file_path = os_path.join(folder, f'Raw Data {size}.csv')
+        write_raw_csv(file_path, acc, fs)
+        yield 'load_csv', lambda: main.load_csv(file_path)
+        yield 'iter_csv', lambda: sum(chunk.shape[1] for chunk in main.iter_csv(file_path))
+
+
+def measure(function, min_time=1.0, max_repeats=100):
+    '''
+    测量一个函数的耗时和峰值内存\\
+    先在tracemalloc下运行一次得到峰值内存（兼作预热），再重复运行直到累计超过min_time秒（至少3次，单次超过min_time时只运行1次），取最短耗时
+    '''
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times = []
+    while len(times) < max_repeats and (sum(times) < min_time or len(times) < 3):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+        if times[0] >= min_time:
+            break
+    return min(times), len(times), peak
+
+
+def run(base, fs, sizes, csv_max, min_time, only=None):
+    results = []
+    with TemporaryDirectory() as folder:
+        for size in sizes:
+            acc = make_acc(size, base)
+            for name, function in kernels(acc, fs, folder if size <= csv_max else None):
+                if only and name not in only:
+                    continue
+                seconds, repeats, peak = measure(function, min_time)
+                results.append({
+                    'kernel': name,
+                    'size': size,
+                    'seconds': seconds,
+                    'repeats': repeats,
+                    'peak_mb': peak / 2 ** 20,
+                    'samples_per_second': size / seconds if seconds else 0.0,
+                })
+                print(f'{name:>14} {size:>9}：{format_time(seconds):>10}，峰值内存{peak / 2 ** 20:9.1f} MB，{repeats}次')
+            del acc
+    return results
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:.1f} µs'
+    if seconds < 1:
+        return f'{seconds * 1e3:.2f} ms'
+    return f'{seconds:.2f} s'
+
+
+def compare(results, old_results, threshold):
+    """与以前的结果比较，打印耗时之比，返回变慢超过threshold倍的项数"""
+    old = {(item['kernel'], item['size']): item for item in old_results}
+    regressions = 0
+    print('\n/// 与以前的结果比较（新/旧）///')
+    for item in results:
+        before = old.get((item['kernel'], item['size']))
+        if before is None:
+            continue
+        ratio = item['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+        memory_ratio = item['peak_mb'] / before['peak_mb'] if before['peak_mb'] else 1.0
+        flag = ''
+        if ratio > threshold:
+            flag = '  <-- 变慢'
+            regressions += 1
+        print(f'{item["kernel"]:>14} {item["size"]:>9}：耗时 x{ratio:.2f}，峰值内存 x{memory_ratio:.2f}{flag}')
+    return regressions
+
+
+def load_base(file_path):
+    """读取Raw Data.csv中的三方向加速度及其采样率；不提供时使用10分钟100 Hz的合成数据"""
+    if not file_path:
+        return synthetic_data(), 100.0
+    data = main.load_csv(file_path)
+    return np.ascontiguousarray(data[1:4]), float(1 / np.median(np.diff(data[0])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='数值计算部分的性能基准测试')
+    parser.add_argument('csv', nargs='?', help='作为测试数据的Raw Data.csv（循环拼接到各个长度），不提供时使用合成数据')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='测试的采样数')
+    parser.add_argument('--max-size', type=int, default=max(SIZES), help='跳过超过此采样数的测试')
+    parser.add_argument('--csv-max', type=int, default=1000000, help='CSV读取只测试不超过此采样数的文件')
+    parser.add_argument('--kernel', nargs='+', help='只测试这些函数')
+    parser.add_argument('--min-time', type=float, default=1.0, help='每项测试的最短累计运行时间（秒）')
+    parser.add_argument('--label', default='', help='写入结果的标签，如版本号')
+    parser.add_argument('-o', '--output', help='将结果保存为JSON')
+    parser.add_argument('--compare', help='与以前保存的JSON结果比较')
+    parser.add_argument('--threshold', type=float, default=1.2, help='耗时超过以前的多少倍视为变慢')
+    args = parser.parse_args()
+
+    base, fs = load_base(args.csv)
+    sizes = [size for size in args.sizes if size <= args.max_size]
+    results = run(base, fs, sizes, args.csv_max, args.min_time, args.kernel)
+    report = {
+        'label': args.label,
+        'time': strftime('%Y-%m-%d %H:%M:%S', gmtime()),
+        'data': args.csv or 'synthetic',
+        'sampling_rate': fs,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as old_file:
+            regressions = compare(results, json.load(old_file)['results'], args.threshold)
+        if regressions:
+            print(f'{regressions}项变慢超过{args.threshold:g}倍')
+            raise SystemExit(1)
@@ -1,20 +1,42 @@
 import csv
-from math import log10,sqrt
-from scipy import signal
-import matplotlib.pyplot as plt
+from math import log10
+from functools import lru_cache
+from importlib import import_module
 import numpy as np
-from requests import get
-from time import strftime, gmtime, sleep
-from os import mkdir
+from requests import get, Session
+from requests.adapters import HTTPAdapter
+try:  # 可选：更快的JSON解析
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+from time import time, strftime, strptime, gmtime, sleep, monotonic, perf_counter
+from calendar import timegm
+from bisect import bisect_left, bisect_right
+from os import mkdir, walk, cpu_count, replace, listdir, utime, getpid, stat as os_stat, path as os_path
+from hashlib import blake2b
+from shutil import rmtree
 import json
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import threading
+from queue import Queue, Empty
 from os import sep
+from collections import deque
+from itertools import islice, chain
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import warnings
+# scipy和matplotlib导入较慢，在用到它们的函数中才导入，使实时监控模式和命令行模式尽快启动
+
+interactive = True  # 命令行模式下为False，出错时不等待按键
 
 
 def throw_an_error(errmsg, stop:bool = True):
     """stop：为真时程序将退出"""
     print('发生错误：'+errmsg)
     if stop:
-        input('因为此错误，程序无法继续运行，按Enter退出...')
+        if interactive:
+            input('因为此错误，程序无法继续运行，按Enter退出...')
         exit(1)
 
 
@@ -24,55 +46,112 @@ def init_folders():
     except FileExistsError:
         pass
     except Exception as e:
-        throw_an_error(e, True)
+        throw_an_error(f'{e}', True)
 
 
-def get_config():
-    with open('config.json', 'r') as config_file:
+def get_config(file_path='config.json'):
+    with open(file_path, 'r') as config_file:
         config = json.load(config_file)
         return config
 
 
-def get_meta(ip):
-    device = get(ip + '/meta').text
+class PhyphoxPoller:
+    '''
+    phyphox远程访问接口\\
+    使用保持连接的Session，避免每次刷新都重新建立TCP连接；只请求三方向加速度和时间，合成加速度在本地计算；每个响应只解析一次
+    ip: 形如http://192.168.xxx的地址
+    timeout: (连接超时, 读取超时)，单位：秒
+    '''
+    def __init__(self, ip, timeout=(3, 5)):
+        self.ip = ip
+        self.timeout = timeout
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.http_time = 0.0  # 最近一次poll请求的耗时，单位：秒
+        self.decode_time = 0.0  # 最近一次poll解析JSON的耗时，单位：秒
+
+    def meta(self):
+        return self.session.get(self.ip + '/meta', timeout=self.timeout).text
+
+    def start(self):
+        self.session.get(self.ip + '/control?cmd=start', timeout=self.timeout)
+
+    def poll(self, last_latest_time):
+        """获取acc_time在last_latest_time之后的数据，返回原始数据(5, N)和实验是否正在进行"""
+        start = perf_counter()
+        response = self.session.get(f'{self.ip}/get?accX={last_latest_time}|acc_time&accY={last_latest_time}|acc_time&accZ={last_latest_time}|acc_time&acc_time={last_latest_time}', timeout=self.timeout)
+        response.raise_for_status()
+        self.http_time = perf_counter() - start
+        start = perf_counter()
+        response_json = json_loads(response.content)
+        buffer = response_json['buffer']
+        # 原始数据，形状为(5, N)，各行依次为时间、x、y、z方向和合成加速度
+        raw_data = np.empty((5, len(buffer['acc_time']['buffer'])))
+        raw_data[0] = buffer['acc_time']['buffer']
+        raw_data[1] = buffer['accX']['buffer']
+        raw_data[2] = buffer['accY']['buffer']
+        raw_data[3] = buffer['accZ']['buffer']
+        np.sqrt(np.einsum('ij,ij->j', raw_data[1:4], raw_data[1:4]), out=raw_data[4])
+        self.decode_time = perf_counter() - start
+        return raw_data, response_json['status']['measuring']
+
+    def close(self):
+        self.session.close()
+
+
+def get_meta(poller, name=''):
+    """name: 同时监控多台设备时附加在日志文件夹名后，避免重名"""
+    device = poller.meta()
     start_time = strftime('%Y%m%d%H%M%S', gmtime())  # UTC
+    if name:
+        start_time += f'_{name}'
     mkdir('./logs/'+start_time)
     with open('./logs/'+start_time+'/meta.json', 'x') as meta_file:
         meta_file.write(device)
     return start_time
 
 
-def analyse_raw_data(start_time, last_latest_time, ip):  # 解析原始数据并存储。每隔3秒从上回的latest位置到这回的latest位置获取数据（即acc_time），避免数据缺失
-    response = get(f'{ip}/get?accX={last_latest_time}|acc_time&accY={last_latest_time}|acc_time&accZ={last_latest_time}|acc_time&acc={last_latest_time}|acc_time&acc_time={last_latest_time}')
-    response_json = response.json()['buffer']
-    raw_data_t = response_json['acc_time']['buffer']  # 原时间数据序列
-    raw_data_x = response_json['accX']['buffer']  # 原x方向数据序列
-    raw_data_y = response_json['accY']['buffer']  # 原y方向数据序列
-    raw_data_z = response_json['accZ']['buffer']  # 原z方向数据序列
-    raw_data_a = response_json['acc']['buffer']  # 原合成数据序列
-    try:  # 判断文件是否存在来决定是否添加表头
-        open(f'./logs/{start_time}/Raw Data.csv', 'r')
-    except FileNotFoundError:
-        file_exists = False
-    else:
-        file_exists = True
-    with open(f'./logs/{start_time}/Raw Data.csv', 'a', newline='') as csv_file:
-        writer = csv.writer(csv_file, delimiter=',')
-        if not file_exists:
-            writer.writerow(['Time (s)', 'Linear Acceleration x (m/s^2)', 'Linear Acceleration y (m/s^2)', 'Linear Acceleration z (m/s^2)', 'Absolute acceleration (m/s^2)'])
-        for t,x,y,z,a in zip(raw_data_t,raw_data_x,raw_data_y,raw_data_z,raw_data_a):
-            writer.writerow([t,x,y,z,a])
-    last_latest_time = raw_data_t[-1]
-    is_measuring = response.json()['status']['measuring']
-    return last_latest_time, raw_data_t, raw_data_x, raw_data_y, raw_data_z, raw_data_a, is_measuring  # TODO:明天该做每三秒的滤波 数据合成 震度估测了
+RAW_DATA_HEADER = ['Time (s)', 'Linear Acceleration x (m/s^2)', 'Linear Acceleration y (m/s^2)', 'Linear Acceleration z (m/s^2)', 'Absolute acceleration (m/s^2)']
+
+
+def analyse_raw_data(start_time, last_latest_time, poller):  # 解析原始数据。每隔3秒从上回的latest位置到这回的latest位置获取数据（即acc_time），避免数据缺失
+    """原始数据在处理阶段存储（见Monitor.process），采集线程不会因写入落后而阻塞"""
+    raw_data, is_measuring = poller.poll(last_latest_time)
+    last_latest_time = raw_data[0, -1]
+    return last_latest_time, raw_data, is_measuring
+
+
+FILTER_SETTINGS = {'fl': 0.1, 'fh': 10, 'btype': 'bandpass', 'order': 4}  # 处理时使用的滤波设置，写入二进制日志的文件头，也是缓存键的一部分
 
 
-def filter_wave(x, dt=0.01, fl=0.1, fh=10, btype="bandpass", order=4):  # https://zhuanlan.zhihu.com/p/615455014
+@lru_cache(maxsize=32)
+def butter_sos(fs, fl=0.1, fh=10, btype="bandpass", order=4):
     '''
-    滤波\\
+    设计巴特沃斯滤波器，以二阶节（sos）形式返回，按(采样率, 截止频率, 类型, 阶数)缓存，每种滤波器只设计一次\\
+    二阶节形式在低截止频率、高阶数时比(b, a)形式数值稳定。参数含义同filter_wave，fs为采样率
+    '''
+    from scipy import signal
+
+    fn = fs / 2.0  # 奈奎斯特频率
+
+    if btype == "lowpass":
+        Wn = fh / fn
+    elif btype == "highpass":
+        Wn = fl / fn
+    elif btype == "bandpass" or btype == "bandstop":
+        Wn = (fl / fn, min(fh / fn, 0.99))  # 采样率过低时高频截止不能超过奈奎斯特频率
+
+    return signal.butter(order, Wn, btype, output='sos')  # scipy的sosfilt要求可写数组，调用方不应修改返回值
+
+
+def filter_wave(x, dt=0.01, fl=FILTER_SETTINGS['fl'], fh=FILTER_SETTINGS['fh'], btype=FILTER_SETTINGS['btype'], order=FILTER_SETTINGS['order']):  # https://zhuanlan.zhihu.com/p/615455014
+    '''
+    零相位滤波\\
     参数含义：
-    x: 信号序列
-    dt: 信号的采样时间间隔
+    x: 信号序列，可以是形状为(..., N)的多通道数组（如(3, 3, N)的加速度、速度、位移），沿最后一维一次性滤波
+    dt: 信号的采样时间间隔，应为1/实际采样率
     fl: 滤波截止频率（低频）
     fh: 滤波截止频率（高频）
     btype: 滤波器类型
@@ -81,19 +160,43 @@ def filter_wave(x, dt=0.01, fl=0.1, fh=10, btype="bandpass", order=4):  # https:
         "bandpass": 带通（保留fl~fh之间的频率成分）
         "bandstop": 带阻（过滤fl~fh之间的频率成分）
     '''
-    fn = 1.0 / dt / 2.0  # 奈奎斯特频率
+    from scipy import signal
 
-    if btype == "lowpass":
-        Wn = fh / fn
-    elif btype == "highpass":
-        Wn = fl / fn
-    elif btype == "bandpass" or btype == "bandstop":
-        Wn = (fl / fn, fh / fn)
+    sos = butter_sos(1.0 / dt, fl, fh, btype, order)
+    return signal.sosfiltfilt(sos, x, axis=-1)
+
+
+class StreamFilter:
+    '''
+    实时监控模式下的流式滤波与积分\\
+    在两次刷新之间保存各通道的滤波器状态（zi）和速度、位移的积分状态，每次只处理新获取的数据，
+    因此每次刷新的计算量只与新数据量有关，且数据块之间不会出现滤波器启动时的瞬态。
+    参数含义同filter_wave，dt为采样时间间隔
+    '''
+    def __init__(self, dt=0.01, fl=FILTER_SETTINGS['fl'], fh=FILTER_SETTINGS['fh'], btype=FILTER_SETTINGS['btype'], order=FILTER_SETTINGS['order']):
+        self.dt = dt
+        self.fl, self.fh, self.btype, self.order = fl, fh, btype, order
+        self.sos = butter_sos(1.0 / dt, fl, fh, btype, order)
+        self.zi = None  # 滤波器状态，形状为(节数, 9, 2)，对应ax,ay,az,vx,vy,vz,dx,dy,dz九个通道
+        self.last_v = np.zeros(3)  # 上回最后一个采样点的x,y,z速度
+        self.last_d = np.zeros(3)  # 上回最后一个采样点的x,y,z位移
 
-    b, a = signal.butter(order, Wn, btype)
-    y = signal.filtfilt(b, a, x)
+    def process(self, a):
+        """输入基线校正后的三方向加速度(3, N)，返回滤波后的三方向加速度、速度、位移，形状为(3, 3, N)"""
+        from scipy import signal
 
-    return y
+        if a.shape[1] == 0:
+            return np.zeros((3, 3, 0))
+        # 转换为速度和位移，接续上回的积分结果
+        waves = integrate(a, self.dt, self.last_v, self.last_d)
+        self.last_v = waves[1, :, -1].copy()
+        self.last_d = waves[2, :, -1].copy()
+
+        data = waves.reshape(9, -1)
+        if self.zi is None:  # 第一次调用时以首个采样点为稳态初值，避免启动瞬态
+            self.zi = signal.sosfilt_zi(self.sos)[:, None, :] * data[None, :, 0, None]
+        filtered, self.zi = signal.sosfilt(self.sos, data, axis=1, zi=self.zi)
+        return filtered.reshape(3, 3, -1)
 
 
 def csis_calc(a,v,csis_v):
@@ -107,19 +210,29 @@ def csis_calc(a,v,csis_v):
     else:
         ii = ia
     ii = round(ii,1)
+    return ii,csis_scale(ii)
+
+
+def csis_scale(ii):
+    """由CSIS仪器烈度求烈度"""
     if ii < 1.0:
         i = 1
     elif ii > 12.0:
         i = 12
     else:
         i = round(ii)
-    return ii,i
+    return i
 
 
 def jma_calc(a):
     ia = 2 * log10(100*a) + 0.94
     ia = round(ia,2)
     ia = int(ia*10)/10
+    return ia,jma_scale(ia)
+
+
+def jma_scale(ia):
+    """由JMA计测震度求震度阶级"""
     if ia <= 0.4:
         i = 0
     elif ia <= 1.4:
@@ -140,7 +253,184 @@ def jma_calc(a):
         i = 6.5
     else:
         i = 7
-    return ia,i
+    return i
+
+
+@lru_cache(maxsize=8)
+def jma_filter_response(n, fs):
+    """JMA计测震度滤波器（周期效果、高截、低截）在长度为n的rfft各频率上的响应，按(n, fs)缓存"""
+    f = np.fft.rfftfreq(n, 1 / fs)
+    f[0] = 1  # 避免除以0，直流分量最后置零
+    y2 = (f / 10) ** 2
+    response = np.sqrt(1 / f)  # 周期效果
+    response /= np.sqrt(np.polyval((0.000155, 0.00134, 0.009664, 0.0557, 0.241, 0.694, 1), y2))  # 高截
+    response *= np.sqrt(1 - np.exp(-(f / 0.5) ** 3))  # 低截
+    response[0] = 0
+    response.flags.writeable = False
+    return response
+
+
+def jma_composed(acc, fs):
+    """按日本气象厅计测震度的算法对已基线校正的三方向加速度(3, N)滤波（周期效果、高截、低截）并合成，返回合成加速度(N,)"""
+    from scipy.fft import rfft, irfft, next_fast_len
+
+    n = acc.shape[1]
+    nfft = next_fast_len(n + int(10 * fs))  # 在末尾补零，避免循环卷积使数据两端互相影响
+    response = jma_filter_response(nfft, fs)
+    composed = np.zeros(n)
+    for component in acc:  # 逐个分向滤波并累加平方，不同时保留三个分向的频谱
+        spectrum = rfft(component - component.mean(), nfft)  # 先去掉残余的偏移，否则补零处的阶跃会经滤波泄漏到数据两端
+        spectrum *= response
+        filtered = irfft(spectrum, nfft)[:n]
+        composed += filtered * filtered
+    return np.sqrt(composed, out=composed)
+
+
+def jma_acc(acc, fs):
+    '''
+    按日本气象厅计测震度的算法，求滤波后三分向合成加速度累计超过0.3秒的值\\
+    参数含义：
+    acc: 已基线校正的三方向加速度，形状为(3, N)，单位m/s²
+    fs: 采样率
+    返回值单位为m/s²，可直接传入jma_calc
+    '''
+    n = acc.shape[1]
+    if n == 0:
+        return 0.0
+    count = min(max(round(0.3 * fs), 1), n)  # 0.3秒对应的采样点数
+    composed = jma_composed(acc, fs)
+    composed.partition(n - count)  # 第count大的值即累计超过0.3秒的加速度，用部分排序代替全排序
+    return float(composed[n - count])
+
+
+class JmaWindow:
+    '''
+    实时监控模式下在最近window秒上计算JMA计测震度，每次刷新只对新数据及其前后的重叠部分滤波\\
+    JMA滤波在频域中进行，一个采样点的结果只受前后约margin秒数据的影响：每次对新数据连同之前margin秒的原始数据和尚未确定的部分一起滤波，
+    之后已有margin秒数据的采样点结果不再改变，存入环形缓冲区；其余为暂定值，下次刷新时重新计算。
+    滤波的耗时只与margin和新数据量有关，与窗口长度无关
+    '''
+    def __init__(self, fs, window=60, margin=10):
+        self.fs = fs
+        self.size = int(window * fs)
+        self.margin = int(margin * fs)
+        self.raw = np.zeros((3, 0))  # 暂定部分及其之前最多margin个采样的原始三方向加速度
+        self.pending = 0  # raw末尾尚未确定的采样数
+        self.final = RingBuffer(1, self.size)  # 已确定的滤波后合成加速度
+
+    def update(self, acc):
+        """追加已基线校正的三方向加速度(3, N)，返回窗口内累计超过0.3秒的加速度"""
+        self.raw = np.concatenate((self.raw, acc), axis=1)
+        self.pending += acc.shape[1]
+        if self.pending == 0:
+            return 0.0
+        composed = jma_composed(self.raw, self.fs)[-self.pending:]
+        settled = max(self.pending - self.margin, 0)  # 之后已有margin个采样的部分
+        if settled:
+            self.final.append(composed[None, :settled])
+            self.pending -= settled
+        self.raw = self.raw[:, -(self.margin + self.pending):]
+        window = np.concatenate((self.final.snapshot()[0], composed[settled:]))[-self.size:]
+        count = min(max(round(0.3 * self.fs), 1), len(window))  # 0.3秒对应的采样点数
+        window.partition(len(window) - count)
+        return float(window[len(window) - count])
+
+
+class WindowMax:
+    '''
+    最近size次采样中的最大值（单调队列）\\
+    队列中只保存此后没有被更大值超过的数据，值单调递减，队首即窗口内的最大值，每个采样均摊O(1)
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.queue = deque()  # (采样序号, 值, 时刻)
+        self.count = 0  # 已经过的采样数
+
+    def update(self, values, times, span=None):
+        """
+        追加一段数据，返回窗口内的最大值及其时刻\\
+        span: 这段数据占的采样数，默认为len(values)；每次刷新只有一个值的（如烈度）传入本次刷新的采样数
+        """
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        if span is None:
+            span = n
+        if n:
+            later_max = np.maximum.accumulate(values[::-1])[::-1]  # 每个值及其之后数据中的最大值
+            keep = np.empty(n, dtype=bool)  # 只有大于之后所有值的数据才可能成为窗口最大值
+            keep[:-1] = values[:-1] > later_max[1:]
+            keep[-1] = True
+            while self.queue and self.queue[-1][1] <= later_max[0]:
+                self.queue.pop()
+            index = np.flatnonzero(keep)
+            self.queue.extend(zip((self.count + span - n + index).tolist(), values[index].tolist(), np.asarray(times, dtype=float)[index].tolist()))
+        self.count += span
+        while self.queue and self.queue[0][0] < self.count - self.size:  # 移出窗口的数据
+            self.queue.popleft()
+        if not self.queue:
+            return 0, 0
+        return self.queue[0][1], round(self.queue[0][2], 2)
+
+
+def update_recent_max(recent_max, raw_data_t, resultants, rt_ia_csis, rt_ia_jma):
+    """更新最近max_range次采样中的最大PGA、PGV、PGD和烈度，返回{'a'/'v'/'d'/'csis'/'jma': (最大值, 时刻)}"""
+    n = len(raw_data_t)
+    result = {}
+    for key, resultant in zip(('a', 'v', 'd'), resultants):
+        result[key] = recent_max[key].update(resultant, raw_data_t)
+    result['csis'] = recent_max['csis'].update((rt_ia_csis,), raw_data_t[-1:], n)
+    result['jma'] = recent_max['jma'].update((rt_ia_jma,), raw_data_t[-1:], n)
+    return result
+
+
+class StaLtaTrigger:
+    '''
+    STA/LTA（短时平均/长时平均）事件触发器，在原始三方向加速度上逐块计算\\
+    特征函数为相邻采样点三方向加速度之差的平方和，不受基线偏移影响；STA、LTA分别为最近sta秒和lta秒特征函数的平均，
+    由保留的最近lta秒特征函数和累加和一次算出整块的比值。比值超过on时触发，此后连续post秒低于off时结束；LTA窗口填满前不触发
+    '''
+    def __init__(self, fs, sta=1, lta=30, on=3.0, off=1.5, post=30):
+        self.nsta = max(int(sta * fs), 1)
+        self.nlta = max(int(lta * fs), self.nsta + 1)
+        self.on, self.off = on, off
+        self.post = int(post * fs)
+        self.tail = np.zeros(0)  # 最近nlta个特征函数值
+        self.last = None  # 上一块最后一个采样点的三方向加速度
+        self.count = 0  # 已处理的采样数
+        self.active = False  # 是否处于触发状态
+        self.quiet = 0  # 触发后末尾连续低于off的采样数
+        self.ratio = 0.0  # 最近一块中的最大STA/LTA
+
+    def update(self, acc):
+        """输入三方向加速度(3, n)，更新并返回触发状态"""
+        n = acc.shape[1]
+        if n == 0:
+            return self.active
+        previous = acc[:, :1] if self.last is None else self.last[:, None]
+        diff = np.diff(np.concatenate((previous, acc), axis=1), axis=1)
+        self.last = acc[:, -1].copy()
+        values = np.concatenate((self.tail, np.einsum('ij,ij->j', diff, diff)))
+        total = np.concatenate(([0.0], np.cumsum(values)))
+        end = np.arange(len(self.tail) + 1, len(values) + 1)  # 本块各采样点在累加和中的位置
+        sta = (total[end] - total[np.maximum(end - self.nsta, 0)]) / self.nsta
+        lta = (total[end] - total[np.maximum(end - self.nlta, 0)]) / self.nlta
+        ready = self.count + np.arange(1, n + 1) >= self.nlta
+        ratio = np.divide(sta, lta, out=np.zeros(n), where=ready & (lta > 0))
+        self.tail = values[-self.nlta:]
+        self.count += n
+        self.ratio = float(ratio.max())
+
+        if not self.active:
+            above = np.flatnonzero(ratio > self.on)
+            if above.size == 0:
+                return False
+            self.active = True
+            ratio = ratio[above[0]:]  # 触发之后的部分
+        loud = np.flatnonzero(ratio >= self.off)
+        self.quiet = len(ratio) - 1 - loud[-1] if loud.size else self.quiet + len(ratio)
+        if self.quiet >= self.post:
+            self.active = False
+        return self.active
 
 
 def format_i_jma(i_jma):
@@ -155,13 +445,8 @@ def format_i_jma(i_jma):
         i_jma = str(i_jma)
     return i_jma
 
-def save_processed_data(start_time, last_latest_time, processed_data: tuple, data_type: str):  # 存储处理后的数据
-    """processed_data: (时间,ax,ay,az,a合成,类型v速度/a加速度)"""
-    raw_data_t = processed_data[0]  # 原时间数据序列
-    data_x = processed_data[1]  # 原x方向数据序列
-    data_y = processed_data[2]  # 原y方向数据序列
-    data_z = processed_data[3]  # 原z方向数据序列
-    data_a = processed_data[4]  # 原合成数据序列
+def processed_data_header(data_type: str):
+    """data_type: a加速度/v速度/d位移，返回(文件名中的类型, 表头)"""
     if data_type == 'v':
         data_type = 'Velocity'
         unit = 'm/s'
@@ -171,422 +456,2140 @@ def save_processed_data(start_time, last_latest_time, processed_data: tuple, dat
     elif data_type == 'd':
         data_type = 'Displacement'
         unit = 'm/s^2'
-    try:  # 判断文件是否存在来决定是否添加表头
-        open(f'./logs/{start_time}/Processed Data ({data_type}).csv', 'r')
-    except FileNotFoundError:
-        file_exists = False
+    return data_type, ['Time (s)', f'{data_type} x ({unit})', f'{data_type} y ({unit})', f'{data_type} z ({unit})', f'Absolute {data_type} ({unit})']
+
+
+BINARY_LOG = 'Data.bin'  # 二进制日志文件名
+BINARY_LOG_MAGIC = b'ICPBIN1\n'
+# 二进制日志的列：时间、原始x,y,z,合成加速度，滤波后x,y,z方向的加速度、速度、位移，及合成加速度、速度、位移
+BINARY_LOG_COLUMNS = ('t', 'raw_x', 'raw_y', 'raw_z', 'raw_a', 'ax', 'ay', 'az', 'vx', 'vy', 'vz', 'dx', 'dy', 'dz', 'aa', 'va', 'da')
+
+
+def binary_file_header(magic, fields):
+    """二进制文件头：魔数、4字节表头长度和JSON表头fields，补齐到8字节的整数倍，使之后的float64数据对齐"""
+    header = json.dumps(fields).encode()
+    header += b' ' * (-(len(magic) + 4 + len(header)) % 8)
+    return magic + len(header).to_bytes(4, 'little') + header
+
+
+def map_binary_file(file_path, magic):
+    """映射binary_file_header格式的二进制文件，不复制数据；返回表头、数据起始的字节位置和数据(行数, 列数)"""
+    with open(file_path, 'rb') as binary_file:
+        if binary_file.read(len(magic)) != magic:
+            raise ValueError(f'{file_path}不是有效的二进制文件')
+        header_length = int.from_bytes(binary_file.read(4), 'little')
+        header = json.loads(binary_file.read(header_length))
+    offset = len(magic) + 4 + header_length
+    columns = len(header['columns'])
+    rows = (os_path.getsize(file_path) - offset) // (8 * columns)  # 忽略程序意外终止时写了一半的行
+    if rows == 0:
+        return header, offset, np.zeros((0, columns))
+    return header, offset, np.memmap(file_path, dtype='<f8', mode='r', offset=offset, shape=(rows, columns))
+
+
+def binary_log_header(sampling_rate, correction):
+    '''
+    二进制日志的文件头\\
+    文件由魔数、4字节表头长度、JSON表头（采样率、基线校正、滤波设置、列名）和按行排列的float64数据组成，
+    每次刷新只追加写入一次，数据分析模式下可用np.memmap直接映射
+    '''
+    return binary_file_header(BINARY_LOG_MAGIC, {
+        'sampling_rate': sampling_rate,
+        'correction': [float(c) for c in correction],
+        'filter': FILTER_SETTINGS,
+        'columns': BINARY_LOG_COLUMNS,
+    })
+
+
+def binary_log_rows(raw_data, waves, resultants):
+    """将原始数据(5, N)、滤波后的数据(3, 3, N)及其合成值(3, N)排列为二进制日志的行(N, 17)"""
+    rows = np.empty((raw_data.shape[1], len(BINARY_LOG_COLUMNS)), dtype='<f8')
+    rows[:, 0:5] = raw_data.T
+    rows[:, 5:14] = waves.reshape(9, -1).T
+    rows[:, 14:17] = resultants.T
+    return rows
+
+
+INDEX_MAGIC = b'ICPIDX1\n'
+# 分块摘要索引的列：块的起始时刻、在处理后数据中的起始行、采样数，合成加速度、速度、位移的最小值、最大值、均方根，块内的CSIS和JMA烈度
+INDEX_COLUMNS = ('start', 'row', 'samples', 'aa_min', 'aa_max', 'aa_rms', 'va_min', 'va_max', 'va_rms', 'da_min', 'da_max', 'da_rms', 'csis', 'jma')
+INDEX_FILES = {1: 'Index (1s).bin', 60: 'Index (1min).bin'}  # 块长（秒）: 索引文件名
+OFFSETS_COLUMNS = ('start', 'offset')  # CSV定位文件的列：一段数据的第一个时刻、这段数据在CSV文件中的起始字节位置
+
+
+def offsets_file(file_name):
+    """CSV文件对应的定位文件名，如Processed Data (Velocity) Offsets.bin"""
+    return f'{os_path.splitext(file_name)[0]} Offsets.bin'
+
+
+class BlockIndex:
+    '''
+    实时监控模式下处理后数据的分块摘要，按span秒对齐分块\\
+    每次刷新的数据按块用reduceat一次算出，跨越两次刷新的块暂存为“未结束的块”，下一次刷新时合并；均方根在块结束时才由平方和换算
+    '''
+    MIN = [3, 6, 9]  # 取最小值的列
+    MAX = [4, 7, 10, 12, 13]  # 取最大值的列
+    SUM = [2, 5, 8, 11]  # 求和的列（未结束时，均方根的列中是平方和）
+
+    def __init__(self, span):
+        self.span = span
+        self.open = None  # 未结束的块
+
+    def update(self, t, resultants, row, csis, jma):
+        """加入一次刷新的数据：时间t(N,)、合成值(3, N)及其在处理后数据中的起始行row、本次的烈度，返回已经结束的块(M, 列数)"""
+        bucket = np.floor(t / self.span)
+        first = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+        blocks = np.empty((len(first), len(INDEX_COLUMNS)))
+        blocks[:, 0] = bucket[first] * self.span
+        blocks[:, 1] = row + first
+        blocks[:, 2] = np.diff(np.append(first, len(t)))
+        for column, values in zip((3, 6, 9), resultants):
+            blocks[:, column] = np.minimum.reduceat(values, first)
+            blocks[:, column + 1] = np.maximum.reduceat(values, first)
+            blocks[:, column + 2] = np.add.reduceat(values * values, first)
+        blocks[:, 12], blocks[:, 13] = csis, jma
+        if self.open is not None:
+            if self.open[0] == blocks[0, 0]:  # 上次未结束的块在本次继续
+                blocks[0, 1] = self.open[1]
+                blocks[0, self.MIN] = np.minimum(blocks[0, self.MIN], self.open[self.MIN])
+                blocks[0, self.MAX] = np.maximum(blocks[0, self.MAX], self.open[self.MAX])
+                blocks[0, self.SUM] += self.open[self.SUM]
+            else:
+                blocks = np.vstack((self.open, blocks))
+        self.open = blocks[-1].copy()
+        return self.finish(blocks[:-1])
+
+    def close(self):
+        """记录结束时输出未结束的块"""
+        blocks = np.zeros((0, len(INDEX_COLUMNS))) if self.open is None else self.finish(self.open[None])
+        self.open = None
+        return blocks
+
+    @staticmethod
+    def finish(blocks):
+        blocks[:, [5, 8, 11]] = np.sqrt(blocks[:, [5, 8, 11]] / blocks[:, 2:3])
+        return blocks
+
+
+class LogWriter(threading.Thread):
+    '''
+    实时监控模式下唯一的写入线程\\
+    日志文件在记录期间保持打开，数据经有界队列送入，每次取出队列中已有的全部数据（最多batch项）写入后统一flush。
+    队列满时put会阻塞，使处理阶段减速，而不会丢失数据。
+    某一项写入失败（如磁盘已满）时记录错误并继续处理队列中的其余数据，put不会因写入线程退出而永久阻塞
+    folder: 日志文件夹
+    '''
+    def __init__(self, folder, maxsize=64, batch=32):
+        super().__init__(daemon=True)
+        self.folder = folder
+        self.queue = Queue(maxsize)
+        self.batch = batch
+        self.files = {}  # 文件名: (文件, csv.writer)
+        self.batches = 0  # 已写入的批数
+        self.items = 0  # 已写入的数据块数
+        self.max_backlog = 0  # 队列中最多积压的数据块数
+        self.write_time = 0.0  # 写入和flush的累计耗时，单位：秒
+        self.errors = 0  # 写入失败的次数
+        self.last_error = None  # 最后一次写入失败的原因
+
+    def put_csv(self, file_name, header, rows, offsets=None):
+        """
+        rows: 形状为(N, 列数)的数组，第一列为时间\\
+        offsets: 不为空时，在写入前把(rows的第一个时刻, 这段数据在CSV文件中的起始字节位置)追加到这个二进制文件，以便之后直接定位
+        """
+        self.queue.put((file_name, header, rows, offsets))
+        self.max_backlog = max(self.max_backlog, self.queue.qsize())
+
+    def put_binary(self, header, rows, file_name=BINARY_LOG):
+        """header: 二进制文件头，只在文件为空时写入；rows: 形状为(N, 列数)的数组，默认写入二进制日志"""
+        self.queue.put((file_name, header, rows, None))
+        self.max_backlog = max(self.max_backlog, self.queue.qsize())
+
+    def put_text(self, file_name, text):
+        """追加一段文本，如Metrics.jsonl的一行"""
+        self.queue.put((file_name, None, text, None))
+        self.max_backlog = max(self.max_backlog, self.queue.qsize())
+
+    def close(self):
+        """写完队列中剩余的数据后关闭文件"""
+        self.queue.put(None)
+        self.join()
+
+    def open_file(self, file_name, header):
+        if file_name.endswith('.bin'):
+            log_file = open(f'{self.folder}/{file_name}', 'ab')
+            if log_file.tell() == 0:
+                log_file.write(header)
+            self.files[file_name] = (log_file, None)
+        elif header is None:  # 文本文件
+            self.files[file_name] = (open(f'{self.folder}/{file_name}', 'a', encoding='utf-8'), None)
+        else:
+            log_file = open(f'{self.folder}/{file_name}', 'a', newline='')
+            writer = csv.writer(log_file, delimiter=',')
+            if log_file.tell() == 0:  # 新文件，先写入表头
+                writer.writerow(header)
+            self.files[file_name] = (log_file, writer)
+        return self.files[file_name]
+
+    def run(self):
+        running = True
+        while running:
+            items = [self.queue.get()]
+            try:
+                while len(items) < self.batch:
+                    items.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            start = perf_counter()
+            for item in items:
+                if item is None:
+                    running = False
+                    continue
+                file_name, header, rows, offsets = item
+                try:
+                    log_file, writer = self.files.get(file_name) or self.open_file(file_name, header)
+                    if offsets is not None:
+                        offsets_file, _ = self.files.get(offsets) or self.open_file(offsets, binary_file_header(INDEX_MAGIC, {'columns': OFFSETS_COLUMNS}))
+                        offsets_file.write(np.array((rows[0, 0], log_file.tell()), dtype='<f8').tobytes())
+                    if isinstance(rows, str):
+                        log_file.write(rows)
+                    elif writer is None:
+                        log_file.write(rows.tobytes())
+                    else:
+                        writer.writerows(rows.tolist())
+                    self.items += 1
+                except Exception as e:  # 丢弃这一项，继续写入其余数据
+                    self.error(file_name, e)
+            for file_name, (log_file, writer) in self.files.items():
+                try:
+                    log_file.flush()
+                except Exception as e:
+                    self.error(file_name, e)
+            self.batches += 1
+            self.write_time += perf_counter() - start
+        for file_name, (log_file, writer) in self.files.items():
+            try:
+                log_file.close()
+            except Exception as e:
+                self.error(file_name, e)
+
+    def error(self, file_name, e):
+        self.errors += 1
+        self.last_error = f'{file_name}: {e}'
+        print(f'----------\n写入失败（第{self.errors}次）：{self.last_error}\n----------')
+
+
+def load_binary_log(path):
+    """
+    映射二进制日志，不复制数据\\
+    返回：表头、原始数据(5, N)、滤波后的三方向加速度、速度、位移(3, 3, N)及其合成值(3, N)
+    """
+    header, offset, data = map_binary_file(f'{path}/{BINARY_LOG}', BINARY_LOG_MAGIC)
+    return header, data[:, 0:5].T, data[:, 5:14].T.reshape(3, 3, -1), data[:, 14:17].T
+
+
+def export_csv(path, block_size=100000):
+    """将二进制日志导出为与phyphox兼容的Raw Data.csv和三个Processed Data文件，分块写入；未触发时只有原始数据的行不写入Processed Data"""
+    header, raw_data, waves, resultants = load_binary_log(path)
+    files = [(f'{path}/Raw Data.csv', RAW_DATA_HEADER, lambda i, j: raw_data[:, i:j])]
+    for data_type, wave, resultant in zip(('a', 'v', 'd'), waves, resultants):
+        file_type, file_header = processed_data_header(data_type)
+        files.append((f'{path}/Processed Data ({file_type}).csv', file_header, lambda i, j, wave=wave, resultant=resultant: np.vstack((raw_data[0, i:j], wave[:, i:j], resultant[i:j]))))
+    for file_path, file_header, block in files:
+        with open(file_path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file, delimiter=',')
+            writer.writerow(file_header)
+            for i in range(0, raw_data.shape[1], block_size):
+                data = block(i, i + block_size)
+                writer.writerows(data[:, ~np.isnan(data).any(axis=0)].T.tolist())
+
+
+def csv_format(file_path):
+    """
+    检测CSV文件的格式，只读取前两行\\
+    返回：(分隔符, 是否以逗号为小数点, 表头行数, 列数)。phyphox可导出逗号、制表符或分号分隔的CSV，分号分隔时使用小数逗号
+    """
+    with open(file_path, 'r', encoding='utf-8-sig') as csv_file:
+        first_line = csv_file.readline()
+        sample = csv_file.readline() or first_line
+    if '\t' in sample:
+        delimiter = '\t'
+    elif ';' in sample:
+        delimiter = ';'
+    else:
+        delimiter = ','
+    decimal_comma = delimiter != ',' and ',' in sample
+    try:
+        float(first_line.split(delimiter)[0].strip().strip('"').replace(',', '.'))
+    except ValueError:
+        header_rows = 1
+    else:
+        header_rows = 0
+    return delimiter, decimal_comma, header_rows, len(sample.split(delimiter))
+
+
+def iter_csv(file_path, chunk_rows=1000000):
+    """分块读取CSV文件，每块为形状(列数, n)的数组，用于比内存大的文件。格式只在开头检测一次"""
+    delimiter, decimal_comma, header_rows, columns = csv_format(file_path)
+    with open(file_path, 'r', encoding='utf-8-sig') as csv_file:
+        for _ in range(header_rows):
+            csv_file.readline()
+        while True:
+            lines = list(islice(csv_file, chunk_rows))
+            if not lines:
+                break
+            if decimal_comma:
+                lines = [line.replace(',', '.') for line in lines]
+            yield np.ascontiguousarray(np.loadtxt(lines, delimiter=delimiter, ndmin=2).T)
+
+
+def load_csv(file_path):
+    """一次性读取phyphox导出的或本程序记录的CSV文件，返回形状为(列数, N)的数组"""
+    delimiter, decimal_comma, header_rows, columns = csv_format(file_path)
+    if decimal_comma:
+        return np.concatenate([np.zeros((columns, 0))] + list(iter_csv(file_path)), axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)  # 只有表头的空文件
+        data = np.loadtxt(file_path, delimiter=delimiter, skiprows=header_rows, ndmin=2, encoding='utf-8-sig')
+    if data.size == 0:
+        return np.zeros((columns, 0))
+    return np.ascontiguousarray(data.T)
+
+
+def load_processed_data(path):
+    """映射缓存条目中的处理后数据，返回时间序列(N,)、滤波后的三方向加速度、速度、位移(3, 3, N)及其合成值(3, N)"""
+    header, raw_data, waves, resultants = load_binary_log(path)
+    return raw_data[0], waves, resultants
+
+
+def process_wave(raw_acc, sampling_rate, correction, stream_filter=None):
+    '''
+    基线校正、积分、滤波与合成\\
+    参数含义：
+    raw_acc: 原三方向加速度，形状为(3, N)
+    sampling_rate: 采样率
+    correction: 三方向基线校正值，形状为(3,)
+    stream_filter: 实时监控模式下传入StreamFilter以接续上回的状态；为None时对整段数据做零相位滤波
+    返回：滤波后的三方向加速度、速度、位移(3, 3, N)，及其合成值(3, N)
+    '''
+    corrected = raw_acc + np.asarray(correction, dtype=float)[:, None]  # 基线校正
+    if stream_filter is not None:
+        waves = stream_filter.process(corrected)
+    else:
+        waves = integrate(corrected, 1 / sampling_rate)  # 转换为速度和位移
+        waves = filter_wave(waves, dt=1 / sampling_rate)  # 对三方向加速度、速度和位移一并滤波
+    return waves, resultant(waves)
+
+
+def integrate(acc, dt, last_v=0, last_d=0):
+    """将三方向加速度(3, N)积分为速度和位移，last_v、last_d为接续的速度和位移初值(3,)，返回加速度、速度、位移(3, 3, N)"""
+    waves = np.empty((3,) + acc.shape)
+    waves[0] = acc
+    np.cumsum(acc, axis=1, out=waves[1])
+    waves[1] *= dt
+    waves[1] += np.asarray(last_v, dtype=float)[..., None]
+    np.cumsum(waves[1], axis=1, out=waves[2])
+    waves[2] *= dt
+    waves[2] += np.asarray(last_d, dtype=float)[..., None]
+    return waves
+
+
+def resultant(waves):
+    """三分向合成：(..., 3, N)的数据沿分向求模，返回(..., N)"""
+    return np.sqrt(np.einsum('...ij,...ij->...j', waves, waves))
+
+
+SPECTRUM_PERIODS = np.geomspace(0.05, 10, 100)  # 反应谱的周期，单位：秒
+
+
+@lru_cache(maxsize=8)
+def oscillator_bank(fs, periods, damping):
+    '''
+    各周期单自由度振子u'' + 2ζωu' + ω²u = -a的离散传递函数，按(采样率, 周期的元组, 阻尼比)缓存\\
+    以加速度在采样点之间线性变化离散化（一阶保持），与Nigam-Jennings法同样精确。返回每个周期的(相对位移的分子, 相对速度的分子, 共同的分母)
+    '''
+    from scipy.signal import cont2discrete, ss2tf
+
+    bank = []
+    for period in periods:
+        wn = 2 * np.pi / period
+        system = (np.array(((0.0, 1.0), (-wn * wn, -2 * damping * wn))), np.array(((0.0,), (-1.0,))), np.eye(2), np.zeros((2, 1)))
+        num, den = ss2tf(*cont2discrete(system, 1 / fs, method='foh')[:4])
+        bank.append((num[0], num[1], den))
+    return bank
+
+
+def response_spectrum(acc, fs, periods=SPECTRUM_PERIODS, damping=0.05, block=1000000):
+    '''
+    弹性反应谱：各周期单自由度振子在加速度acc(..., N)作用下的最大绝对加速度Sa、相对速度Sv和相对位移Sd，返回(Sa, Sv, Sd)，形状均为(..., 周期数)\\
+    各周期振子以二阶递推滤波器逐块计算，块之间接续滤波器状态，临时数组只与block成正比，acc可以是np.memmap映射的长记录
+    '''
+    from scipy.signal import lfilter
+
+    bank = oscillator_bank(float(fs), tuple(float(period) for period in periods), float(damping))
+    wn = 2 * np.pi / np.asarray(periods, dtype=float)
+    shape = acc.shape[:-1] + (len(bank),)
+    sa, sv, sd = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    states = np.zeros((len(bank), 2) + acc.shape[:-1] + (2,))  # 各振子相对位移、相对速度滤波器的状态
+    for first in range(0, acc.shape[-1], block):
+        chunk = np.asarray(acc[..., first:first + block], dtype=float)
+        for k, (num_d, num_v, den) in enumerate(bank):
+            d, states[k, 0] = lfilter(num_d, den, chunk, zi=states[k, 0])
+            v, states[k, 1] = lfilter(num_v, den, chunk, zi=states[k, 1])
+            sd[..., k] = np.maximum(sd[..., k], np.abs(d).max(axis=-1))
+            sv[..., k] = np.maximum(sv[..., k], np.abs(v).max(axis=-1))
+            sa[..., k] = np.maximum(sa[..., k], np.abs(2 * damping * wn[k] * v + wn[k] * wn[k] * d).max(axis=-1))  # 绝对加速度 = -(2ζωu' + ω²u)
+    return sa, sv, sd
+
+
+def estimate_sampling_rate(t, window=32):
+    '''
+    由时间序列测定采样率，允许时间戳抖动和丢点\\
+    先以跨越多个采样的时间差的中位数估计采样周期，确定各采样点在均匀网格上的序号（丢点处跳过相应的个数），
+    再对时间戳和序号做最小二乘直线拟合，斜率即采样周期。
+    间隔的离散程度小于周期的1/4时，把每个间隔直接折算为整数个周期；抖动更大时单个间隔无法区分抖动和丢点，
+    改为比较前后各window个采样相对均匀网格的偏移（中位数），偏移出现阶跃处才计为丢点。
+    模拟测试（100~500Hz，各5组）：抖动标准差不超过周期的一半、丢点不超过1%时，1000个采样误差在1%以内，10万个采样在0.3%以内；
+    丢点达5%时周期的初始估计偏大，误差约3%~5%；抖动超过周期的一半或采样不足100个时误差可达数%，应在config.json中设置sampling_rate
+    '''
+    t = np.asarray(t, dtype=float)
+    intervals = np.diff(t)
+    positive = intervals[intervals > 0]
+    if positive.size == 0:
+        raise ValueError('数据太少，无法测定采样率，请在config.json中设置sampling_rate')
+    span = max(min(16, len(intervals) // 4), 1)
+    period = float(np.median((t[span:] - t[:-span]) / span))  # 跨span个采样的平均间隔，抖动的影响减小为1/span
+    if period <= 0:
+        period = float(np.median(positive))
+    ratio = intervals / period
+    spread = 1.4826 * np.median(np.abs(ratio - np.median(ratio)))  # 间隔的稳健标准差，以周期计
+    if spread < 1 / 4 or len(t) < 2 * window:
+        steps = np.maximum(np.round(ratio), 0)
+    else:
+        from scipy.ndimage import median_filter
+
+        offset = (t - t[0]) / period - np.arange(len(t))  # 相对均匀网格的偏移（周期数），丢点处阶跃增加
+        level = median_filter(offset, size=window, mode='nearest')  # 以各采样为中心的window个采样的中位数
+        half = window // 2
+        index = np.arange(1, len(t))
+        jumps = level[np.minimum(index + half, len(t) - 1)] - level[np.maximum(index - half, 0)]  # 各间隔前后偏移之差
+        # 丢点使其前后约window个间隔的差都接近丢点数：以差低于0.25的间隔分段，段内最大差超过0.5时，
+        # 段前后偏移之差即段内丢点总数（相距不足window的几次丢点会落在同一段），记在段内最长的几个间隔处
+        segments = np.concatenate(([0], np.flatnonzero(np.diff(jumps < 0.25)) + 1))
+        steps = np.ones(len(intervals))
+        for start, end in zip(segments, np.append(segments[1:], len(jumps))):
+            if jumps[start] >= 0.25 and jumps[start:end].max() >= 0.5:
+                before = level[max(start + 1 - half, 0)]
+                after = level[min(end + half, len(t) - 1)]
+                count = max(round(float(after - before)), 1)
+                longest = start + np.argsort(intervals[start:end])[::-1][:count]
+                steps[longest] += count // len(longest)
+                steps[longest[:count % len(longest)]] += 1
+    index = np.concatenate(([0], np.cumsum(steps)))
+    index -= index.mean()
+    return float((index * index).sum() / (index * (t - t.mean())).sum())
+
+
+def interpolate(raw_data, t):
+    """将原始数据(5, N)线性插值到单调递增的时刻t(M,)，各方向共用同一组下标和权重，合成加速度由插值后的三方向重新计算"""
+    times = raw_data[0]
+    result = np.empty((5, len(t)))
+    result[0] = t
+    if len(times) == 1:
+        result[1:4] = raw_data[1:4]
     else:
-        file_exists = True
-    with open(f'./logs/{start_time}/Processed Data ({data_type}).csv', 'a', newline='') as csv_file:
-        writer = csv.writer(csv_file, delimiter=',')
-        if not file_exists:
-            writer.writerow(['Time (s)', f'{data_type} x ({unit})', f'{data_type} y ({unit})', f'{data_type} z ({unit})', f'Absolute {data_type} ({unit})'])
-        for t,x,y,z,a in zip(raw_data_t,data_x,data_y,data_z,data_a):
-            writer.writerow([t,x,y,z,a])
-    last_latest_time = raw_data_t[-1]
-    return last_latest_time, raw_data_t, data_x, data_y, data_z, data_a
-
-def check_for_update(version):
+        index = np.clip(np.searchsorted(times, t, side='right') - 1, 0, len(times) - 2)
+        left = times[index]
+        span = times[index + 1] - left
+        weight = np.divide(t - left, span, out=np.zeros(len(t)), where=span > 0)
+        result[1:4] = raw_data[1:4, index] * (1 - weight) + raw_data[1:4, index + 1] * weight
+    result[4] = np.sqrt(np.einsum('ij,ij->j', result[1:4], result[1:4]))
+    return result
+
+
+class Resampler:
+    '''
+    按acc_time把原始数据重采样到间隔为1/sampling_rate的均匀时间网格，使积分和滤波的步长与实际一致\\
+    phyphox的时间戳有抖动，经Wi-Fi获取时还会丢点；间隔超过gap个采样周期的视为数据缺失，计入gaps和gap_time后线性插值补齐。
+    可以逐块调用（实时监控模式、分块分析），网格和插值在块之间连续，结果与一次处理整段数据相同
+    '''
+    def __init__(self, sampling_rate, gap=1.5):
+        self.dt = 1 / sampling_rate
+        self.gap = gap
+        self.origin = None  # 网格起点，即第一个采样点的时刻
+        self.index = 0  # 下一个网格点的序号
+        self.last = None  # 上一块的最后一个采样点，用于在块之间插值
+        self.gaps = 0  # 检测到的数据缺失次数
+        self.gap_time = 0.0  # 缺失的总时长，单位：秒
+
+    def process(self, raw_data):
+        """输入原始数据(5, N)，返回重采样后的数据(5, M)"""
+        if raw_data.shape[1] == 0:
+            return raw_data
+        if self.last is None:
+            self.origin = raw_data[0, 0]
+        else:
+            raw_data = np.concatenate((self.last[:, None], raw_data), axis=1)
+        intervals = np.diff(raw_data[0])
+        missing = intervals[intervals > self.gap * self.dt]
+        self.gaps += missing.size
+        self.gap_time += float((missing - self.dt).sum())
+        end = int(np.floor((raw_data[0, -1] - self.origin) / self.dt + 1e-6)) + 1  # 不超过最后一个采样点的网格点数
+        grid = self.origin + np.arange(self.index, max(end, self.index)) * self.dt
+        self.index = max(end, self.index)
+        self.last = raw_data[:, -1].copy()
+        return interpolate(raw_data, grid)
+
+
+def resample(raw_data, sampling_rate):
+    """将整段原始数据(5, N)重采样到均匀时间网格，返回重采样后的数据和Resampler（含缺失统计）"""
+    resampler = Resampler(sampling_rate)
+    return resampler.process(raw_data), resampler
+
+
+class BlockAnalyser:
+    '''
+    数据分析模式下分块处理比内存大的记录\\
+    原始数据逐块追加，积分接续上一块的速度和位移；零相位滤波和JMA滤波在前后各多取margin秒数据的窗口上进行，只输出窗口中间的部分。
+    滤波器的响应在margin秒内已衰减到可以忽略，因此输出与整段处理一致，而内存占用只与block成正比
+    '''
+    def __init__(self, sampling_rate, correction, block=1000000, margin=120, jma=True):
+        self.sampling_rate = sampling_rate
+        self.dt = 1 / sampling_rate
+        self.correction = np.asarray(correction, dtype=float)
+        self.block = block
+        self.margin = int(margin * sampling_rate)
+        self.jma = jma
+        self.raw = np.zeros((5, 0))  # 缓冲区中的原始数据
+        self.waves = np.zeros((3, 3, 0))  # 缓冲区中积分后、尚未滤波的数据
+        self.start = 0  # 缓冲区第一个采样点的序号
+        self.emitted = 0  # 下一个待输出的采样点序号
+        self.last_v = np.zeros(3)  # 已积分部分最后一个采样点的x,y,z速度
+        self.last_d = np.zeros(3)  # 已积分部分最后一个采样点的x,y,z位移
+
+    def push(self, raw_data):
+        """追加原始数据(5, n)，返回已经可以输出的块（见emit）"""
+        if raw_data.shape[1]:
+            waves = integrate(raw_data[1:4] + self.correction[:, None], self.dt, self.last_v, self.last_d)
+            self.last_v = waves[1, :, -1].copy()
+            self.last_d = waves[2, :, -1].copy()
+            self.raw = np.concatenate((self.raw, raw_data), axis=1)
+            self.waves = np.concatenate((self.waves, waves), axis=2)
+        blocks = []
+        while self.start + self.raw.shape[1] >= self.emitted + self.block + self.margin:  # 块后已有足够的数据
+            blocks.append(self.emit(self.emitted + self.block))
+        return blocks
+
+    def finish(self):
+        """数据读取完毕后输出剩余的部分"""
+        end = self.start + self.raw.shape[1]
+        return [self.emit(end)] if end > self.emitted else []
+
+    def emit(self, end):
+        '''
+        对[emitted, end)前后各加margin的窗口滤波，输出这一段\\
+        返回：原始数据(5, n)、滤波后的三方向加速度、速度、位移(3, 3, n)、其合成值(3, n)，以及JMA滤波后的合成加速度(n,)（未启用时为None）
+        '''
+        low = max(self.emitted - self.margin, self.start) - self.start
+        high = min(end + self.margin, self.start + self.raw.shape[1]) - self.start
+        keep = slice(self.emitted - self.start - low, end - self.start - low)
+        waves = filter_wave(self.waves[..., low:high], dt=self.dt)[..., keep]
+        composed = jma_composed(self.raw[1:4, low:high] + self.correction[:, None], self.sampling_rate)[keep] if self.jma else None
+        raw_data = self.raw[:, self.emitted - self.start:end - self.start]
+        self.emitted = end
+        drop = max(end - self.margin, self.start) - self.start  # 之后的窗口用不到的数据
+        self.raw = self.raw[:, drop:]
+        self.waves = self.waves[..., drop:]
+        self.start += drop
+        return raw_data, waves, resultant(waves), composed
+
+
+def open_raw_data(path, block):
+    """读取Raw Data.csv：不超过block个采样时返回(原始数据(5, N), None)，否则返回(None, 按块读取的迭代器)"""
+    chunks = iter_csv(f'{path}/Raw Data.csv', block)
+    first = next(chunks, np.zeros((5, 0)))
+    second = next(chunks, None)
+    if second is None:
+        return first, None
+    return None, chain((first, second), chunks)
+
+
+def stream_analyse(path, chunks, sampling_rate, correction, block=1000000, margin=120):
+    '''
+    分块分析长记录：读取、重采样、积分、滤波、求最大值和烈度都逐块进行，处理后的数据写入记录文件夹中的二进制日志，内存占用与记录长度无关\\
+    chunks: 按块读取的原始数据(5, n)，见open_raw_data
+    返回：采样率、PGA、PGV、PGD及其时刻、CSIS和JMA烈度，与main_process处理整段数据的结果一致
+    '''
+    first = next(chunks)
+    if not sampling_rate:
+        sampling_rate = estimate_sampling_rate(first[0])
+        print(f'您没有设置采样率，程序自动测定的采样率为：{sampling_rate} Hz\n----------')
+    resampler = Resampler(sampling_rate)
+    analyser = BlockAnalyser(sampling_rate, correction, block, margin, jma_03)
+    count = max(round(0.3 * sampling_rate), 1)  # 0.3秒对应的采样点数
+    top = np.zeros(0)  # 目前为止JMA滤波后合成加速度中最大的count个值
+    maxima, max_times = np.zeros(3), np.zeros(3)
+
+    def blocks():
+        for chunk in chain((first,), chunks):
+            yield from analyser.push(resampler.process(chunk))
+        yield from analyser.finish()
+
+    temp_path = f'{path}/{BINARY_LOG}.part'  # 写完后再改名，避免中断时留下不完整的日志
+    with open(temp_path, 'wb') as log_file:
+        log_file.write(binary_log_header(sampling_rate, correction))
+        for raw_data, waves, resultants, composed in blocks():
+            index = resultants.argmax(axis=1)
+            values = resultants[(0, 1, 2), index]
+            larger = values > maxima
+            maxima[larger] = values[larger]
+            max_times[larger] = raw_data[0, index][larger]
+            if composed is not None:
+                top = np.concatenate((top, composed))
+                if top.size > count:
+                    top = np.partition(top, top.size - count)[top.size - count:]
+            log_file.write(binary_log_rows(raw_data, waves, resultants).tobytes())
+    replace(temp_path, f'{path}/{BINARY_LOG}')
+    if resampler.gaps:
+        print(f'检测到{resampler.gaps}处数据缺失，共{round(resampler.gap_time, 2)}秒，已线性插值补齐。\n----------')
+
+    a_max, v_max, d_max = maxima.tolist()
+    a_max_time, v_max_time, d_max_time = (round(float(t), 2) for t in max_times)
+    ia_csis, i_csis = csis_calc(a_max, v_max, csis_v)
+    ia_jma, i_jma = jma_calc(float(top.min()) if jma_03 and top.size else a_max)
+    return sampling_rate, a_max, a_max_time, v_max, v_max_time, d_max, d_max_time, max(1.0, ia_csis), max(1, i_csis), max(-3.0, ia_jma), max(0, i_jma)
+
+
+CACHE_FOLDER = './cache'  # 数据分析模式处理结果的缓存文件夹
+CACHE_VERSION = 3  # 处理方法改变时加1，使以前的缓存全部失效
+CACHE_SUMMARY = 'Summary.json'  # 缓存条目中的结果，最后写入，存在即表示条目完整
+CACHE_INCOMPLETE_AGE = 86400  # 没有结果的条目文件夹（分析被强行中断时留下）超过这个时间（秒）没有变化时删除
+
+
+def file_digest(file_path, memo):
+    '''
+    文件内容的哈希（BLAKE2b，16字节）\\
+    memo: {绝对路径: [大小, 修改时间, 哈希]}，大小和修改时间都没有变化时直接使用记下的哈希，不再读取文件
+    '''
+    stat = os_stat(file_path)
+    known = memo.get(os_path.abspath(file_path))
+    if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known[2]
+    digest = blake2b(digest_size=16)
+    with open(file_path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    memo[os_path.abspath(file_path)] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return digest.hexdigest()
+
+
+class ResultCache:
+    '''
+    数据分析模式下处理结果的缓存\\
+    以原始数据文件内容的哈希和处理参数（采样率、基线校正、滤波、烈度选项）为键，每个条目是folder中以键命名的文件夹，
+    其中的Data.bin为二进制日志格式的处理后数据（可直接映射），Summary.json为各项最大值和烈度。
+    条目先在临时文件夹中生成，处理成功后才改名为条目文件夹，失败时删除，因此条目文件夹总是完整的。
+    数据或参数改变后键随之改变，不会读到过期的结果；条目总大小超过limit字节时，删除最久未使用的条目
+    '''
+    def __init__(self, folder=CACHE_FOLDER, limit=1024 * 2 ** 20):
+        self.folder = folder
+        self.limit = limit
+        self.index_path = f'{folder}/index.json'  # 源文件的哈希记录，见file_digest
+        try:
+            mkdir(folder)
+        except FileExistsError:
+            pass
+
+    def key(self, source, params):
+        """源文件source与处理参数params对应的键"""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as index_file:
+                memo = json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            memo = {}
+        digest = file_digest(source, memo)
+        memo = {name: value for name, value in memo.items() if os_path.exists(name)}  # 去掉已不存在的文件
+        temp_path = f'{self.index_path}.{getpid()}.part'  # 批量分析时多个进程可能同时写入，各自写完后再替换
+        with open(temp_path, 'w', encoding='utf-8') as index_file:
+            json.dump(memo, index_file)
+        replace(temp_path, self.index_path)
+        params = json.dumps(dict(params, version=CACHE_VERSION, source=digest), sort_keys=True)
+        return blake2b(params.encode(), digest_size=16).hexdigest()
+
+    def entry(self, key):
+        """键对应的条目文件夹，由store在处理成功后创建"""
+        return f'{self.folder}/{key}'
+
+    def create(self, key):
+        """为键创建临时文件夹，处理后数据写入其中；成功时交给store，失败时交给discard"""
+        temp = f'{self.folder}/{key}.{getpid()}.part'  # 批量分析时多个进程可能同时处理同一个记录
+        rmtree(temp, ignore_errors=True)  # 同一进程号以前中断时留下的
+        mkdir(temp)
+        return temp
+
+    def discard(self, temp):
+        """删除处理失败或被中断的临时文件夹"""
+        rmtree(temp, ignore_errors=True)
+
+    def load(self, key):
+        """读取条目中的结果，没有完整的条目时返回None；读取后更新其使用时间"""
+        summary_path = f'{self.folder}/{key}/{CACHE_SUMMARY}'
+        try:
+            with open(summary_path, 'r', encoding='utf-8') as summary_file:
+                summary = json.load(summary_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        utime(summary_path)
+        return summary
+
+    def store(self, key, temp, summary):
+        """把结果写入临时文件夹temp（处理后数据已写入其中），改名为条目文件夹，然后按大小淘汰旧条目"""
+        with open(f'{temp}/{CACHE_SUMMARY}', 'w', encoding='utf-8') as summary_file:
+            json.dump(summary, summary_file, default=lambda value: value.item())  # numpy的数值转换为Python类型
+        entry = self.entry(key)
+        if not os_path.exists(f'{entry}/{CACHE_SUMMARY}'):
+            rmtree(entry, ignore_errors=True)  # 以前的版本中断时留下的不完整条目
+        try:
+            replace(temp, entry)
+        except OSError:  # 其他进程已先完成同一条目，使用其结果
+            self.discard(temp)
+        self.evict(key)
+
+    def evict(self, keep):
+        '''
+        按使用时间从旧到新删除条目，直到总大小不超过limit；keep为正在使用的条目，不删除\\
+        没有结果的文件夹可能正被其他进程写入，只在超过CACHE_INCOMPLETE_AGE秒没有变化时删除
+        '''
+        entries = []
+        for name in listdir(self.folder):
+            summary_path = f'{self.folder}/{name}/{CACHE_SUMMARY}'
+            if name == keep or not os_path.isdir(f'{self.folder}/{name}'):
+                continue
+            if not os_path.exists(summary_path):
+                try:
+                    changed = max([os_stat(f'{self.folder}/{name}').st_mtime] + [os_stat(f'{self.folder}/{name}/{file}').st_mtime for file in listdir(f'{self.folder}/{name}')])
+                except OSError:  # 正被其他进程改名或删除
+                    continue
+                if time() - changed > CACHE_INCOMPLETE_AGE:
+                    rmtree(f'{self.folder}/{name}', ignore_errors=True)
+                continue
+            size = sum(os_stat(f'{self.folder}/{name}/{file}').st_size for file in listdir(f'{self.folder}/{name}'))
+            entries.append((os_stat(summary_path).st_mtime, size, name))
+        keep_size = sum(os_stat(f'{self.folder}/{keep}/{file}').st_size for file in listdir(f'{self.folder}/{keep}'))
+        total = keep_size + sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.limit:
+                break
+            try:
+                rmtree(f'{self.folder}/{name}')
+            except OSError:  # Windows下正被其他进程映射的文件无法删除
+                continue
+            total -= size
+
+
+def processing_params(sampling_rate, correction):
+    """决定处理结果的参数，作为缓存键的一部分"""
+    return {
+        'sampling_rate': sampling_rate,
+        'correction': [float(c) for c in correction],
+        'filter': FILTER_SETTINGS,
+        'csis_v': csis_v,
+        'jma_0.3': jma_03,
+    }
+
+
+def raw_source(path):
+    """记录文件夹中原始数据所在的文件：优先使用Raw Data.csv，没有时使用二进制日志"""
+    return f'{path}/Raw Data.csv' if os_path.exists(f'{path}/Raw Data.csv') else f'{path}/{BINARY_LOG}'
+
+
+def read_source(path, block):
+    """读取记录文件夹中的原始数据，返回值同open_raw_data；二进制日志中的原始数据超过block个采样时同样按块读取"""
+    if raw_source(path).endswith('.csv'):
+        return open_raw_data(path, block)
+    raw = load_binary_log(path)[1]
+    if raw.shape[1] <= block:
+        return np.array(raw), None
+    return None, (np.array(raw[:, i:i + block]) for i in range(0, raw.shape[1], block))
+
+
+def analyse_recording(path, sampling_rate, correction, block=1000000, cache=None):
+    '''
+    从原始数据分析一个记录文件夹，结果通过cache缓存：数据和参数都没有变化时直接映射缓存中的处理后数据\\
+    超过block个采样的原始数据分块分析
+    返回：处理后数据所在的条目文件夹、时间(N,)、滤波后的三方向加速度、速度、位移(3, 3, N)、其合成值(3, N)，以及结果{'sampling_rate', 'a_max', ...}
+    '''
+    cache = cache or ResultCache()
+    key = cache.key(raw_source(path), processing_params(sampling_rate, correction))
+    entry = cache.entry(key)
+    summary = cache.load(key)
+    if summary is not None:
+        print('----------\n处理设置与原始数据都没有变化，直接使用缓存的结果。\n----------')
+        return (entry,) + load_processed_data(entry) + (summary,)
+
+    raw_data, chunks = read_source(path, block)
+    temp = cache.create(key)
     try:
-        response = get('https://api.github.com/repos/Han0HanZero/PhyphoxAccelerationAnalyser/releases')
+        if chunks is not None:
+            print(f'记录超过{block}个采样，将分块分析。\n----------')
+            sampling_rate, a_max, a_max_time, v_max, v_max_time, d_max, d_max_time, ia_csis, i_csis, ia_jma, i_jma = stream_analyse(temp, chunks, sampling_rate, correction, block)
+        else:
+            sampling_rate, auto_correction, stream_filter, jma_window, raw_data_t, waves, resultants, a_max, v_max, ia_csis, i_csis, ia_jma, i_jma, rt_a_max, rt_v_max, rt_ia_csis, rt_i_csis, rt_ia_jma, rt_i_jma, a_max_time, v_max_time, d_max, rt_d_max, d_max_time = main_process('1', raw_data, sampling_rate, False, None, None, correction, 0, 0, 0, 0, 1.0, 1, -3.0, 0, 0, 0)
+            with open(f'{temp}/{BINARY_LOG}', 'wb') as log_file:
+                log_file.write(binary_log_header(sampling_rate, correction))
+                log_file.write(binary_log_rows(interpolate(raw_data, raw_data_t), waves, resultants).tobytes())
+    except BaseException:  # 包括Ctrl+C，不留下不完整的条目
+        cache.discard(temp)
+        raise
+    summary = {
+        'sampling_rate': sampling_rate,
+        'a_max': a_max, 'a_max_time': a_max_time,
+        'v_max': v_max, 'v_max_time': v_max_time,
+        'd_max': d_max, 'd_max_time': d_max_time,
+        'ia_csis': ia_csis, 'i_csis': i_csis,
+        'ia_jma': ia_jma, 'i_jma': i_jma,
+    }
+    cache.store(key, temp, summary)
+    return (entry,) + load_processed_data(entry) + (summary,)
+
+
+def check_for_update(version, timeout=3):
+    """检查新版本，timeout秒内没有响应时放弃；交互模式下在后台线程中运行，不推迟启动"""
+    try:
+        response = get('https://api.github.com/repos/Han0HanZero/PhyphoxAccelerationAnalyser/releases', timeout=timeout)
+        latest_version = response.json()[0]['tag_name']
     except Exception as e:
         print(f'最新版本信息获取失败，请手动检查更新：{e}')
     else:
-        latest_version = response.json()[0]['tag_name']
         if version != latest_version:
             print(f'有新版本（{latest_version}）！前往https://github.com/Han0HanZero/phyphoxAccelerationAnalyser/releases/latest或https://hanice.lanzouo.com/b01g0x7ra（密码:0721）下载。')
         else:
             print('当前是最新版本。')
 
-def main_process(choice, processed, sampling_rate, auto_correction, last_latest_vx, last_latest_vy, last_latest_vz, a_max, v_max, a_max_time, v_max_time, ia_csis, i_csis, ia_jma, i_jma, correction_x, correction_y, correction_z, last_latest_dx, last_latest_dy, last_latest_dz, d_max, d_max_time):
-    if processed:
-        with open(path + '/Processed Data (Linear Acceleration).csv', 'r') as data_file:  # 解析a数据
-            data = csv.reader(data_file, delimiter=',')
-            for row in data:
-                if row[0] == 'Time (s)':
-                    continue
-                raw_data_t.append(float(row[0]))
-                ax.append(float(row[1]))
-                ay.append(float(row[2]))
-                az.append(float(row[3]))
-                aa.append(float(row[4]))
-        with open(path + '/Processed Data (Velocity).csv', 'r') as data_file:  # 解析v数据
-            data = csv.reader(data_file, delimiter=',')
-            for row in data:
-                if row[0] == 'Time (s)':
-                    continue
-                vx.append(float(row[1]))
-                vy.append(float(row[2]))
-                vz.append(float(row[3]))
-                va.append(float(row[4]))
-        with open(path + '/Processed Data (Displacement).csv', 'r') as data_file:  # 解析d数据
-            data = csv.reader(data_file, delimiter=',')
-            for row in data:
-                if row[0] == 'Time (s)':
-                    continue
-                dx.append(float(row[1]))
-                dy.append(float(row[2]))
-                dz.append(float(row[3]))
-                da.append(float(row[4]))
-    else:
-        # 测定采样率
-        if not sampling_rate:
-            sampling_rate = ((len(raw_data_t) - 1) / raw_data_t[-1] - raw_data_t[0])
-            print(f'您没有设置采样率，程序自动测定的采样率为：{sampling_rate} Hz\n----------')
-
-        # 基线校正
-        if auto_correction:
-            if choice == '0':
-                correction_x = sum(raw_data_x) / len(raw_data_x)
-                correction_y = sum(raw_data_y) / len(raw_data_y)
-                correction_z = sum(raw_data_z) / len(raw_data_z)
-                print(f'自动基线校正结果：\nX方向：{correction_x}\nY方向：{correction_y}\nZ方向：{correction_z}\n----------')
-                auto_correction = False
-            else:
-                print('数据分析模式下，自动基线校正不可用。\n----------')
-        for x, y, z in zip(raw_data_x, raw_data_y, raw_data_z):
-            x += correction_x
-            y += correction_y
-            z += correction_z
-            corrected_ax.append(x)
-            corrected_ay.append(y)
-            corrected_az.append(z)
-
-        # 转换为速度和位移
-        corrected_vx = (np.cumsum(corrected_ax)) * (1 / sampling_rate) + last_latest_vx
-        corrected_vy = (np.cumsum(corrected_ay)) * (1 / sampling_rate) + last_latest_vy
-        corrected_vz = (np.cumsum(corrected_az)) * (1 / sampling_rate) + last_latest_vz
-        corrected_dx = (np.cumsum(list(corrected_vx))) * (1 / sampling_rate) + last_latest_dx
-        corrected_dy = (np.cumsum(list(corrected_vy))) * (1 / sampling_rate) + last_latest_dy
-        corrected_dz = (np.cumsum(list(corrected_vz))) * (1 / sampling_rate) + last_latest_dz
-        if choice == '0':
-            last_latest_vx = corrected_vx[-1]
-            last_latest_vy = corrected_vy[-1]
-            last_latest_vz = corrected_vz[-1]
-            last_latest_dx = corrected_dx[-1]
-            last_latest_dy = corrected_dy[-1]
-            last_latest_dz = corrected_dz[-1]
-
-        # 对原三方向加速度和速度进行滤波
-        # 加速度
-        for row in filter_wave(x=corrected_ax):
-            ax.append(row)
-        for row in filter_wave(x=corrected_ay):
-            ay.append(row)
-        for row in filter_wave(x=corrected_az):
-            az.append(row)
-        # 速度
-        for row in filter_wave(x=corrected_vx):
-            vx.append(row)
-        for row in filter_wave(x=corrected_vy):
-            vy.append(row)
-        for row in filter_wave(x=corrected_vz):
-            vz.append(row)
-        # 位移
-        for row in filter_wave(x=corrected_dx):
-            dx.append(row)
-        for row in filter_wave(x=corrected_dy):
-            dy.append(row)
-        for row in filter_wave(x=corrected_dz):
-            dz.append(row)
-        '''
-        dx = corrected_dx
-        dy = corrected_dy
-        dz = corrected_dz
-        '''
-        # 合成滤波后加速度
-        # print('正在合成')
-        for x, y, z in zip(ax, ay, az):
-            aa.append(sqrt(x ** 2 + y ** 2 + z ** 2))
-        # 速度
-        for x, y, z in zip(vx, vy, vz):
-            va.append(sqrt(x ** 2 + y ** 2 + z ** 2))
-        # 位移
-        for x, y, z in zip(dx, dy, dz):
-            da.append(sqrt(x ** 2 + y ** 2 + z ** 2))
+def main_process(choice, raw_data, sampling_rate, auto_correction, stream_filter, jma_window, correction, a_max, v_max, a_max_time, v_max_time, ia_csis, i_csis, ia_jma, i_jma, d_max, d_max_time):
+    """raw_data: 原始数据，形状为(5, N)"""
+    raw_data_t = raw_data[0]
 
+    # 测定采样率
+    if not sampling_rate:
+        sampling_rate = estimate_sampling_rate(raw_data_t)
+        print(f'您没有设置采样率，程序自动测定的采样率为：{sampling_rate} Hz\n----------')
+
+    # 重采样到均匀时间网格（实时监控模式下由Monitor逐块进行）
+    if choice != '0':
+        raw_data, resampler = resample(raw_data, sampling_rate)
+        raw_data_t = raw_data[0]
+        if resampler.gaps:
+            print(f'检测到{resampler.gaps}处数据缺失，共{round(resampler.gap_time, 2)}秒，已线性插值补齐。\n----------')
+    raw_acc = raw_data[1:4]
+
+    # 基线校正
+    if auto_correction:
         if choice == '0':
-            # 存储处理后数据
-            save_processed_data(start_time, last_latest_time, (raw_data_t, ax, ay, az, aa), 'a')
-            save_processed_data(start_time, last_latest_time, (raw_data_t, vx, vy, vz, va), 'v')
-            save_processed_data(start_time, last_latest_time, (raw_data_t, dx, dy, dz, da), 'd')
+            correction = raw_acc.mean(axis=1)
+            print(f'自动基线校正结果：\nX方向：{correction[0]}\nY方向：{correction[1]}\nZ方向：{correction[2]}\n----------')
+            auto_correction = False
+        else:
+            print('数据分析模式下，自动基线校正不可用。\n----------')
+
+    if choice == '0' and stream_filter is None:  # 流式滤波：接续上回的滤波器状态和积分状态，只处理本次获取的新数据
+        stream_filter = StreamFilter(dt=1 / sampling_rate)
+    waves, resultants = process_wave(raw_acc, sampling_rate, correction, stream_filter)
 
-    # 计算PGA
+    # 计算PGA、PGV、PGD
     # print('正在筛选PGA')
-    rt_a_max = max(aa)
+    max_index = resultants.argmax(axis=1)
+    rt_a_max, rt_v_max, rt_d_max = resultants[(0, 1, 2), max_index].tolist()
     if rt_a_max > a_max:
         a_max = rt_a_max
-        a_max_time = round(raw_data_t[aa.index(a_max)], 2)
-    # 计算PGV
-    rt_v_max = max(va)
+        a_max_time = round(float(raw_data_t[max_index[0]]), 2)
     if rt_v_max > v_max:
         v_max = rt_v_max
-        v_max_time = round(raw_data_t[va.index(v_max)], 2)
-    # PGD
-    rt_d_max = max(da)
+        v_max_time = round(float(raw_data_t[max_index[1]]), 2)
     if rt_d_max > d_max:
         d_max = rt_d_max
-        d_max_time = round(raw_data_t[da.index(d_max)], 2)
+        d_max_time = round(float(raw_data_t[max_index[2]]), 2)
 
     # 计算烈度
     rt_ia_csis, rt_i_csis = csis_calc(rt_a_max, rt_v_max,csis_v)
-    rt_ia_jma, rt_i_jma = jma_calc(rt_a_max)
+    corrected = raw_acc + np.asarray(correction, dtype=float)[:, None]  # JMA滤波同样使用基线校正后的加速度
+    if not jma_03:  # 使用瞬时PGA
+        rt_ia_jma, rt_i_jma = jma_calc(rt_a_max)
+    elif choice == '0':  # 在最近一段时间的滑动窗口上计算
+        if jma_window is None:
+            jma_window = JmaWindow(sampling_rate)
+        rt_ia_jma, rt_i_jma = jma_calc(jma_window.update(corrected))
+    else:
+        rt_ia_jma, rt_i_jma = jma_calc(jma_acc(corrected, sampling_rate))
     ia_csis = max(ia_csis, rt_ia_csis)
     i_csis = max(i_csis, rt_i_csis)
     ia_jma = max(ia_jma, rt_ia_jma)
     i_jma = max(i_jma, rt_i_jma)
 
-    return sampling_rate, auto_correction, last_latest_vx, last_latest_vy, last_latest_vz, last_latest_time, a_max, v_max, ia_csis, i_csis, ia_jma, i_jma, rt_a_max, rt_v_max, rt_ia_csis, rt_i_csis, rt_ia_jma, rt_i_jma, a_max_time, v_max_time, last_latest_dx, last_latest_dy, last_latest_dz, d_max, rt_d_max, d_max_time
+    return sampling_rate, auto_correction, stream_filter, jma_window, raw_data_t, waves, resultants, a_max, v_max, ia_csis, i_csis, ia_jma, i_jma, rt_a_max, rt_v_max, rt_ia_csis, rt_i_csis, rt_ia_jma, rt_i_jma, a_max_time, v_max_time, d_max, rt_d_max, d_max_time
 
 
-if __name__ == '__main__':
-    # 变量初始化
-    raw_data_t = []  # 原时间数据序列
-    raw_data_x = []  # 原x方向数据序列
-    raw_data_y = []  # 原y方向数据序列
-    raw_data_z = []  # 原z方向数据序列
-    raw_data_a = []  # 原合成数据序列
-    ia_csis, i_csis = 1.0, 1
-    ia_jma, i_jma = -3.0, 0
-    a_max = 0
-    v_max = 0
-    d_max = 0
-    rt_a_max = 0
-    rt_v_max = 0
-    rt_d_max = 0
-    a_max_time = 0
-    v_max_time = 0
-    d_max_time = 0
-    last_latest_time = 0
-    is_recording = False
-    config = get_config()
-    ip = config['ip']
-    delay = config['delay']
-    retry_limit = config['retry_limit']
-    refresh_time = config['refresh_time']
-    sampling_rate = config['sampling_rate']
+def minmax_decimate(t, y, bins, start=None, end=None):
+    '''
+    保留峰值的抽稀：把t在[start, end]内的数据按采样数等分为bins段，每段只保留最小值和最大值（按原顺序），
+    首尾采样点也保留，因此PGA等峰值不会因抽稀丢失。数据不多于2 * bins个时原样返回\\
+    t须单调递增，返回抽稀后的(t, y)
+    '''
+    first = 0 if start is None else max(int(np.searchsorted(t, start)) - 1, 0)
+    last = len(t) if end is None else min(int(np.searchsorted(t, end, side='right')) + 1, len(t))
+    n = last - first
+    bins = max(int(bins), 1)
+    if n <= 2 * bins:
+        return t[first:last], y[first:last]
+    per = n // bins
+    body = y[first:first + per * bins].reshape(bins, per)
+    offsets = first + np.arange(bins) * per
+    index = np.concatenate(([first], offsets + body.argmin(axis=1), offsets + body.argmax(axis=1), [last - 1]))
+    if first + per * bins < last:  # 不足一段的剩余数据
+        tail = y[first + per * bins:last]
+        index = np.concatenate((index, first + per * bins + np.array((tail.argmin(), tail.argmax()))))
+    index = np.unique(index)  # 排序并去重
+    return t[index], y[index]
+
+
+def plot_decimated(axes, t, y, **kwargs):
+    '''
+    在axes上绘制抽稀到像素分辨率的曲线，缩放或平移时按可见范围重新抽稀，放大后可以看到全部原始数据\\
+    kwargs传给axes.plot，返回Line2D
+    '''
+    def bins():
+        return axes.get_window_extent().width  # 每个像素一段
+
+    line, = axes.plot(*minmax_decimate(t, y, bins()), **kwargs)
+
+    def redraw(axes):
+        start, end = axes.get_xlim()
+        line.set_data(*minmax_decimate(t, y, bins(), start, end))
+
+    axes.callbacks.connect('xlim_changed', redraw)  # 普通函数由matplotlib强引用保存，不会被回收
+    return line
+
+
+def plot_waves(raw_data_t, waves, resultants, a_max, a_max_time, v_max, v_max_time):
+    """绘制合成加速度和三方向加速度的图象，返回Figure。长时间的记录按像素分辨率抽稀后绘制"""
+    import matplotlib.pyplot as plt
+
+    (ax, ay, az), aa = waves[0], resultants[0]
+    # plt.plot(raw_data_t, data_x, linewidth=1, color='green')
+    # plt.plot(raw_data_t, data_y, linewidth=1, color='blue')
+    # plt.plot(raw_data_t, data_z, linewidth=1, color='yellow')
+    fig, ((ax00, ax01), (ax10, ax11)) = plt.subplots(2, 2, sharex=True, sharey=True)
+    plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']
+    plt.rcParams['axes.unicode_minus'] = False
+    ax00.set_xlabel("时间 (s)")
+    ax00.grid(True)
+    ax00.set_ylabel("三分向合成后加速度 (m/s²)")
+    plot_decimated(ax00, raw_data_t, aa, linewidth=1, color='blue')
+    if a_max_time == v_max_time:
+        ax00.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²\nPGV: {v_max}m/s)', (a_max_time, a_max))
+    else:
+        ax00.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²)', (a_max_time, a_max))
+        ax00.annotate(f'({v_max_time}s\nPGV: {v_max}m/s)', (v_max_time, v_max))
+    ax01.set_xlabel("时间 (s)")
+    ax01.grid(True)
+    ax01.set_ylabel("X方向加速度 (m/s²)")
+    plot_decimated(ax01, raw_data_t, ax, linewidth=1, color='blue')
+    if a_max_time == v_max_time:
+        ax01.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²\nPGV: {v_max}m/s)', (a_max_time, a_max))
+    else:
+        ax01.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²)', (a_max_time, a_max))
+        ax01.annotate(f'({v_max_time}s\nPGV: {v_max}m/s)', (v_max_time, v_max))
+    ax10.set_xlabel("时间 (s)")
+    ax10.grid(True)
+    ax10.set_ylabel("Y方向加速度 (m/s²)")
+    plot_decimated(ax10, raw_data_t, ay, linewidth=1, color='blue')
+    if a_max_time == v_max_time:
+        ax10.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²\nPGV: {v_max}m/s)', (a_max_time, a_max))
+    else:
+        ax10.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²)', (a_max_time, a_max))
+        ax10.annotate(f'({v_max_time}s\nPGV: {v_max}m/s)', (v_max_time, v_max))
+    ax11.set_xlabel("时间 (s)")
+    ax11.grid(True)
+    ax11.set_ylabel("Z方向加速度 (m/s²)")
+    plot_decimated(ax11, raw_data_t, az, linewidth=1, color='blue')
+    if a_max_time == v_max_time:
+        ax11.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²\nPGV: {v_max}m/s)', (a_max_time, a_max))
+    else:
+        ax11.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²)', (a_max_time, a_max))
+        ax11.annotate(f'({v_max_time}s\nPGV: {v_max}m/s)', (v_max_time, v_max))
+    return fig
+
+
+def plot_spectrum(periods, sa, sv, sd, damping=0.05):
+    """绘制三分向的Sa、Sv、Sd反应谱（形状均为(3, 周期数)），周期取对数坐标，返回Figure"""
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, 3, figsize=(15, 4.5))
+    plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']
+    plt.rcParams['axes.unicode_minus'] = False
+    fig.suptitle(f'反应谱（阻尼比{round(damping * 100, 2)}%）')
+    for axes_, values, label in zip(axes, (sa, sv, sd), ('Sa (m/s²)', 'Sv (m/s)', 'Sd (m)')):
+        for component, color, name in zip(values, ('green', 'blue', 'orange'), ('X', 'Y', 'Z')):
+            axes_.plot(periods, component, linewidth=1, color=color, label=f'{name}方向')
+        axes_.set_xscale('log')
+        axes_.set_xlabel('周期 (s)')
+        axes_.set_ylabel(label)
+        axes_.grid(True, which='both')
+        axes_.legend()
+    return fig
+
+
+def save_spectrum(file_path, periods, sa, sv, sd):
+    """将三分向反应谱写入CSV，每行一个周期"""
+    header = ['Period (s)'] + [f'{name} {axis} ({unit})' for name, unit in (('Sa', 'm/s^2'), ('Sv', 'm/s'), ('Sd', 'm')) for axis in 'XYZ']
+    with open(file_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(np.column_stack((periods, sa.T, sv.T, sd.T)).tolist())
+
+
+def detect_recording(path):
+    """判断记录文件夹中的数据：'binary'二进制日志/'processed'处理后的CSV/'raw'只有原始数据/None不是记录文件夹"""
+    if os_path.exists(f'{path}/{BINARY_LOG}'):
+        return 'binary'
+    if not os_path.exists(f'{path}/Raw Data.csv'):
+        return None
+    if os_path.exists(f'{path}/Processed Data (Velocity).csv') and os_path.exists(f'{path}/Processed Data (Displacement).csv'):
+        return 'processed'
+    return 'raw'
+
+
+def load_index(path, span):
+    """映射记录文件夹中块长为span秒的分块摘要索引，返回表头和数据(块数, 列数)"""
+    header, offset, data = map_binary_file(f'{path}/{INDEX_FILES[span]}', INDEX_MAGIC)
+    return header, data
+
+
+def find_indexed(roots):
+    """在roots下（含子文件夹）查找带有分块摘要索引的实时监控记录"""
+    return sorted(folder for root in roots for folder, folders, files in walk(root) if INDEX_FILES[60] in files)
+
+
+def parse_time(text, epoch):
+    '''
+    查询时刻转换为相对记录开始的秒数\\
+    text为数字时即为相对秒数；否则为UTC时间“YYYY-MM-DD HH:MM[:SS]”，或“HH:MM[:SS]”（日期取记录开始的日期）
+    '''
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    if len(text) <= 8:
+        text = strftime('%Y-%m-%d ', gmtime(epoch)) + text
+    for pattern in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            return timegm(strptime(text, pattern)) - epoch
+        except ValueError:
+            continue
+    raise ValueError(f'无法识别的时间：{text}')
+
+
+def query_index(path, start, end):
+    '''
+    用分块摘要索引统计时间段[start, end)（相对记录开始的秒数，按整秒对齐）内的各项最大值，不读取数据本身\\
+    完整落在时间段内的分钟块直接使用，两端不足一分钟的部分使用秒块，因此读取的索引行数每端最多59行加上分钟块数；块的起始时刻用二分查找定位
+    返回{'samples', 'a_max', 'a_max_time', ..., 'csis', 'jma', 'first_row', 'last_row'}，时刻为最大值所在秒块的起始时刻；时间段内没有数据时返回None
+    '''
+    header, minutes = load_index(path, 60)
+    seconds = load_index(path, 1)[1]
+    start, end = np.floor(start), np.ceil(end)
+
+    def rows(blocks, low, high):
+        column = blocks[:, 0]
+        return blocks[bisect_left(column, low):bisect_left(column, high)]
+
+    whole_start, whole_end = np.ceil(start / 60) * 60, np.floor(end / 60) * 60
+    if whole_end > whole_start:
+        parts = [rows(seconds, start, whole_start), rows(minutes, whole_start, whole_end), rows(seconds, whole_end, end)]
+    else:
+        parts = [rows(seconds, start, end)]
+    blocks = np.concatenate([np.asarray(part) for part in parts])
+    if len(blocks) == 0:
+        return None
+
+    result = {'samples': int(blocks[:, 2].sum()), 'first_row': int(blocks[0, 1]), 'last_row': int(blocks[-1, 1] + blocks[-1, 2])}
+    for name, column in (('a', 4), ('v', 7), ('d', 10)):
+        index = int(blocks[:, column].argmax())
+        block = blocks[index]
+        if len(parts) == 3 and len(parts[0]) <= index < len(parts[0]) + len(parts[1]):  # 最大值在分钟块中，到秒块中找出所在的一秒
+            inner = np.asarray(rows(seconds, block[0], block[0] + 60))
+            block = inner[int(inner[:, column].argmax())] if len(inner) else block
+        result[f'{name}_max'] = float(blocks[index, column])
+        result[f'{name}_max_time'] = float(block[0])
+        result[f'{name}_rms'] = float(np.sqrt((blocks[:, column + 1] ** 2 * blocks[:, 2]).sum() / blocks[:, 2].sum()))
+    result['csis'] = float(blocks[:, 12].max())
+    result['jma'] = float(blocks[:, 13].max())
+    return result
+
+
+def read_range(path, first_row, last_row, start, end):
+    '''
+    读取处理后数据中[first_row, last_row)行里时间在[start, end)内的部分\\
+    二进制日志按行号直接映射；CSV先在定位文件中二分查找到包含start的那段数据的字节位置，从那里读到end为止，没有定位文件时读取整个文件
+    返回：时间(N,)、滤波后的三方向加速度、速度、位移(3, 3, N)及其合成值(3, N)
+    '''
+    if os_path.exists(f'{path}/{BINARY_LOG}'):
+        header, raw_data, waves, resultants = load_binary_log(path)
+        t = np.array(raw_data[0, first_row:last_row])
+        waves, resultants = np.array(waves[..., first_row:last_row]), np.array(resultants[:, first_row:last_row])
+    else:
+        data = []
+        for data_type in ('Linear Acceleration', 'Velocity', 'Displacement'):
+            file_name = f'{path}/Processed Data ({data_type}).csv'
+            offset = 0
+            if os_path.exists(offsets_file(file_name)):
+                offsets = map_binary_file(offsets_file(file_name), INDEX_MAGIC)[2]
+                position = bisect_right(offsets[:, 0], start) - 1
+                offset = int(offsets[max(position, 0), 1]) if len(offsets) else 0
+            values = []
+            with open(file_name, 'r', newline='') as csv_file:
+                csv_file.seek(offset)
+                if offset == 0:
+                    csv_file.readline()  # 表头
+                for line in csv_file:
+                    row = line.split(',')
+                    if float(row[0]) >= end:
+                        break
+                    values.append(row)
+            data.append(np.array(values, dtype=float).reshape(-1, 5).T)
+        length = min(block.shape[1] for block in data)
+        data = np.stack([block[:, :length] for block in data])  # (3, 5, N)
+        t, waves, resultants = data[0, 0], data[:, 1:4], data[:, 4]
+    keep = (t >= start) & (t < end)
+    return t[keep], waves[..., keep], resultants[:, keep]
+
+
+def find_recordings(roots):
+    """在roots下（含子文件夹）查找所有记录文件夹，包括实时监控模式的日志和phyphox导出的文件夹"""
+    recordings = []
+    for root in roots:
+        for folder, folders, files in walk(root):
+            if detect_recording(folder):
+                recordings.append(folder)
+    return sorted(recordings)
+
+
+def init_worker(config, plot):
+    """批量分析子进程的初始化：设置main_process用到的配置项"""
+    global csis_v, jma_03
     csis_v = config['csis_v']
     jma_03 = config['jma_0.3']
-    max_range = config['max_range']
-    enable_pgd = config['enable_pgd']
-    auto_correction = config['correction']['auto_correction']
-    correction_x = config['correction']['x']
-    correction_y = config['correction']['y']
-    correction_z = config['correction']['z']
-    last_latest_vx = 0
-    last_latest_vy = 0
-    last_latest_vz = 0
-    last_latest_dx = 0
-    last_latest_dy = 0
-    last_latest_dz = 0
+    if plot:
+        import matplotlib
+        matplotlib.use('Agg')
 
-    init_folders()
 
-    version = 'v2.1.1-alpha.2'
+def analyse_folder(path, sampling_rate, correction, plot=False, block=1000000, cache_size=1024):
+    """批量分析中分析一个记录文件夹，在子进程中运行，返回汇总信息；plot为真时将图象保存到该文件夹的Waveform.png。超过block个采样的原始数据分块分析，结果缓存在不超过cache_size MB的缓存中"""
+    summary = {'folder': path}
+    try:
+        cache = ResultCache(limit=cache_size * 2 ** 20)
+        entry, raw_data_t, waves, resultants, result = analyse_recording(path, sampling_rate, correction, block, cache)
+        sampling_rate = result['sampling_rate']
+        a_max, a_max_time, v_max, v_max_time, d_max, d_max_time = (result[key] for key in ('a_max', 'a_max_time', 'v_max', 'v_max_time', 'd_max', 'd_max_time'))
+        ia_csis, i_csis, ia_jma, i_jma = (result[key] for key in ('ia_csis', 'i_csis', 'ia_jma', 'i_jma'))
+        summary.update({
+            'samples': len(raw_data_t),
+            'sampling_rate': sampling_rate,
+            'duration': float(raw_data_t[-1] - raw_data_t[0]),
+            'pga': a_max, 'pga_time': a_max_time,
+            'pgv': v_max, 'pgv_time': v_max_time,
+            'pgd': d_max, 'pgd_time': d_max_time,
+            'csis': ia_csis, 'csis_scale': i_csis,
+            'jma': ia_jma, 'jma_scale': format_i_jma(i_jma),
+        })
+        if plot:
+            import matplotlib.pyplot as plt
+            fig = plot_waves(raw_data_t, waves, resultants, a_max, a_max_time, v_max, v_max_time)
+            fig.savefig(f'{path}/Waveform.png', dpi=150)
+            plt.close(fig)
+    except Exception as e:
+        summary['error'] = repr(e)
+    return summary
 
-    print(f'Intensity Calculator for Phyphox {version}\nby HanZero')
-    check_for_update(version)
-    print('\n输入序号进入相应模式：\n0 - 实时监控\n1 - 数据分析\n')
-    choice = input('>>> ')
-    if choice == '0':
-        # 请求IP
-        if not ip:
-            ip = input('----------\n请输入手机上显示的IP地址：')  # 格式化为http://192.168.xxx格式
-        if ip[0] != 'h':
-            ip = 'http://' + ip
-        elif ip[4] == 's':
-            ip = 'http://' + ip.removeprefix('https://')
-        ip = ip.removesuffix('/')
 
-        # 元数据获取
-        start_time = get_meta(ip)
+BATCH_SUMMARY_FIELDS = ('folder', 'samples', 'sampling_rate', 'duration', 'pga', 'pga_time', 'pgv', 'pgv_time', 'pgd', 'pgd_time', 'csis', 'csis_scale', 'jma', 'jma_scale', 'error')
 
-        # 开始实验
-        print('----------')
-        print(f'参数预览：\nIP地址：{ip}\n重试限制：{retry_limit}\n刷新间隔：{refresh_time} s\n采样率：{sampling_rate} Hz\n计算CSIS标准烈度时参考PGV：{csis_v}\n计算JMA标准烈度时使用持续最大0.3秒的PGA（暂未使用）：{jma_03}\n“最近”最大PGA、PGV和烈度指代的时间间隔（暂未使用）：过去{max_range}次采样\n显示PGD（实验性）：{enable_pgd}\n加速度基线校正(x,y,z)：{correction_x}m/s²,{correction_y}m/s²,{correction_z}m/s²')
-        print(f'实验将在{config["delay"]}秒后自动开始，您不需在app上设置启动延迟...')
+
+def batch_analyse(roots, output, config, workers=None, plot=False):
+    '''
+    批量分析roots下的全部记录，每个子进程分析一个记录，汇总表写入output（.json为JSON，否则为CSV）\\
+    workers: 子进程数，默认为CPU核数
+    '''
+    recordings = find_recordings(roots)
+    print(f'找到{len(recordings)}个记录。\n----------')
+    correction = np.array((config['correction']['x'], config['correction']['y'], config['correction']['z']), dtype=float)
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers or cpu_count(), initializer=init_worker, initargs=(config, plot)) as executor:
+        futures = [executor.submit(analyse_folder, path, config['sampling_rate'], correction, plot, config['analysis_block'], config['cache_size']) for path in recordings]
+        for count, future in enumerate(as_completed(futures), 1):
+            summary = future.result()
+            summaries.append(summary)
+            state = f'失败：{summary["error"]}' if 'error' in summary else f'CSIS {summary["csis"]} ({summary["csis_scale"]})，JMA {summary["jma"]} ({summary["jma_scale"]})'
+            print(f'[{count}/{len(recordings)}] {summary["folder"]}：{state}')
+    summaries.sort(key=lambda summary: summary['folder'])
+    if output.endswith('.json'):
+        with open(output, 'w', encoding='utf-8') as output_file:
+            json.dump(summaries, output_file, ensure_ascii=False, indent=2)
+    else:
+        with open(output, 'w', newline='', encoding='utf-8') as output_file:
+            writer = csv.DictWriter(output_file, BATCH_SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(summaries)
+    print(f'----------\n汇总已写入{output}。\n----------')
+    return summaries
+
+
+def format_ip(ip):
+    """格式化为http://192.168.xxx格式"""
+    ip = ip.strip()
+    if ip[0] != 'h':
+        ip = 'http://' + ip
+    elif ip[4] == 's':
+        ip = 'http://' + ip.removeprefix('https://')
+    return ip.removesuffix('/')
+
+
+class RingBuffer:
+    '''
+    固定大小的环形缓冲区，保存最近size个采样的多通道数据\\
+    写入时不分配内存，只覆盖最旧的数据；读取时按时间顺序返回副本
+    '''
+    def __init__(self, channels, size):
+        self.size = size
+        self.data = np.zeros((channels, size))
+        self.end = 0  # 下一个写入位置
+        self.length = 0  # 已有的数据量
+
+    def append(self, values):
+        """追加数据(channels, n)"""
+        n = values.shape[1]
+        if n >= self.size:
+            self.data[:] = values[:, n - self.size:]
+            self.end, self.length = 0, self.size
+            return
+        first = min(n, self.size - self.end)  # 写到末尾为止的部分，其余从头写入
+        self.data[:, self.end:self.end + first] = values[:, :first]
+        self.data[:, :n - first] = values[:, first:]
+        self.end = (self.end + n) % self.size
+        self.length = min(self.length + n, self.size)
+
+    def snapshot(self):
+        """按时间顺序返回缓冲区中数据的副本(channels, length)"""
+        if self.length < self.size:  # 尚未写满时数据从0开始连续存放
+            return self.data[:, :self.length].copy()
+        return np.concatenate((self.data[:, self.end:], self.data[:, :self.end]), axis=1)
+
+
+DASHBOARD_PAGE = '''<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>Intensity Calculator for Phyphox - 实时波形</title>
+<style>
+body { font-family: sans-serif; margin: 12px; background: #fafafa; }
+.device { margin-bottom: 24px; }
+.values { font-size: 18px; margin: 6px 0; }
+canvas { width: 100%; height: 180px; background: #fff; border: 1px solid #ccc; display: block; margin-bottom: 6px; }
+</style>
+</head>
+<body>
+<div id="devices">等待数据...</div>
+<script>
+function draw(canvas, t, y, color, unit) {
+  const ratio = window.devicePixelRatio || 1;
+  canvas.width = canvas.clientWidth * ratio;
+  canvas.height = canvas.clientHeight * ratio;
+  const ctx = canvas.getContext('2d');
+  ctx.clearRect(0, 0, canvas.width, canvas.height);
+  if (t.length < 2) return;
+  const t0 = t[0], t1 = t[t.length - 1];
+  const top = Math.max(...y.map(Math.abs), 1e-6) * 1.1;
+  const x = v => (v - t0) / (t1 - t0 || 1) * canvas.width;
+  const yy = v => canvas.height * (0.5 - v / top / 2);
+  ctx.strokeStyle = color;
+  ctx.lineWidth = ratio;
+  ctx.beginPath();
+  ctx.moveTo(x(t[0]), yy(y[0]));
+  for (let i = 1; i < t.length; i++) ctx.lineTo(x(t[i]), yy(y[i]));
+  ctx.stroke();
+  ctx.fillStyle = '#333';
+  ctx.font = (12 * ratio) + 'px sans-serif';
+  ctx.fillText(top.toPrecision(3) + ' ' + unit, 4, 14 * ratio);
+  ctx.fillText(t0.toFixed(1) + ' s', 4, canvas.height - 4);
+  ctx.fillText(t1.toFixed(1) + ' s', canvas.width - 60 * ratio, canvas.height - 4);
+}
+const source = new EventSource('/events');
+source.onmessage = event => {
+  const devices = JSON.parse(event.data);
+  const root = document.getElementById('devices');
+  if (root.children.length !== devices.length) {
+    root.innerHTML = devices.map((d, i) => `<div class="device"><h3>${d.name}</h3><div class="values" id="values${i}"></div>` +
+      `<canvas id="a${i}"></canvas><canvas id="v${i}"></canvas></div>`).join('');
+  }
+  devices.forEach((d, i) => {
+    document.getElementById('values' + i).textContent =
+      (d.noise ? `未触发：噪声RMS ${d.noise[0].toFixed(4)} m/s²　峰值 ${d.noise[1].toFixed(4)} m/s²　STA/LTA ${d.noise[2].toFixed(2)}　` :
+      `实时PGA ${d.pga.toFixed(4)} m/s²　实时PGV ${d.pgv.toFixed(4)} m/s　CSIS ${d.csis} (${d.i_csis})　JMA ${d.jma} (${d.i_jma})　`) +
+      `本次记录最大：CSIS ${d.max_csis} (${d.max_i_csis})　JMA ${d.max_jma} (${d.max_i_jma})` +
+      (d.sa ? `　反应谱最大Sa ${d.sa[0]} m/s²（周期${d.sa[1]} s）` : '');
+    draw(document.getElementById('a' + i), d.a[0], d.a[1], '#1f4fd1', 'm/s²');
+    draw(document.getElementById('v' + i), d.v[0], d.v[1], '#d1551f', 'm/s');
+  });
+};
+</script>
+</body>
+</html>
+'''
+
+
+class Dashboard:
+    '''
+    实时监控模式下的网页波形\\
+    每次处理后把滤波后的合成加速度和速度写入各设备固定大小的环形缓冲区（最近window秒；未触发时为去掉平均值的原始合成加速度，速度为0），
+    网页通过SSE（Server-Sent Events）接收数据，抽稀和绘图分别在网页服务线程和浏览器中进行，不占用采集和处理的时间
+    '''
+    def __init__(self, port, window=300, points=1000, host='127.0.0.1'):
+        self.window = window
+        self.points = points  # 每条曲线发送的最多点数（按最大最小值抽稀）
+        self.buffers = {}  # 设备名 -> RingBuffer(时间、合成加速度、合成速度)
+        self.status = {}  # 设备名 -> 最新的数值
+        self.version = 0  # 每次写入加1，网页服务线程据此判断是否有新数据
+        self.condition = threading.Condition()
+        self.closed = False
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+
+    def push(self, monitor):
+        """写入一台设备本次处理的结果，在处理阶段调用"""
+        with self.condition:
+            buffer = self.buffers.get(monitor.label)
+            if buffer is None:
+                buffer = self.buffers[monitor.label] = RingBuffer(3, max(int(self.window * monitor.sampling_rate), 1))
+            if monitor.noise is not None:
+                buffer.append(np.vstack((monitor.raw_data_t, monitor.magnitude, np.zeros_like(monitor.magnitude))))
+            else:
+                buffer.append(np.vstack((monitor.raw_data_t, monitor.resultants[0], monitor.resultants[1])))
+            self.status[monitor.label] = {
+                'name': f'{monitor.label}{monitor.ip}',
+                'pga': monitor.rt_a_max, 'pgv': monitor.rt_v_max,
+                'csis': monitor.rt_ia_csis, 'i_csis': monitor.rt_i_csis,
+                'jma': monitor.rt_ia_jma, 'i_jma': format_i_jma(monitor.rt_i_jma),
+                'max_csis': monitor.ia_csis, 'max_i_csis': monitor.i_csis,
+                'max_jma': monitor.ia_jma, 'max_i_jma': format_i_jma(monitor.i_jma),
+                'sa': monitor.spectrum_peak(),
+                'noise': monitor.noise,
+            }
+            self.version += 1
+            self.condition.notify_all()
+
+    def payload(self):
+        """取出各设备的缓冲区副本，抽稀后编码为JSON"""
+        with self.condition:
+            snapshots = [(self.status[key], buffer.snapshot()) for key, buffer in self.buffers.items()]
+        devices = []
+        for status, (t, aa, va) in snapshots:
+            a = minmax_decimate(t, aa, self.points // 2)
+            v = minmax_decimate(t, va, self.points // 2)
+            devices.append(dict(status, a=[np.round(column, 5).tolist() for column in a], v=[np.round(column, 6).tolist() for column in v]))
+        return json.dumps(devices, ensure_ascii=False)
+
+    def handler(self):
+        dashboard = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/':
+                    body = DASHBOARD_PAGE.encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif self.path == '/events':
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    seen = -1
+                    try:
+                        while not dashboard.closed:
+                            with dashboard.condition:
+                                dashboard.condition.wait_for(lambda: dashboard.version != seen or dashboard.closed, timeout=15)
+                                version = dashboard.version
+                            if version == seen:  # 长时间没有新数据，发送注释保持连接
+                                self.wfile.write(b': keep-alive\n\n')
+                            else:
+                                seen = version
+                                self.wfile.write(f'data: {dashboard.payload()}\n\n'.encode())
+                            self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):  # 网页已关闭
+                        pass
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Metrics:
+    '''
+    实时监控的各阶段耗时和计数\\
+    阶段：http（请求phyphox）、decode（解析JSON）、resample（重采样）、process（滤波、积分与烈度计算）、spectrum（反应谱）、save（交给写入线程）、write（写入线程实际写文件）
+    每次处理后生成一条记录，由写入线程追加到日志文件夹中的Metrics.jsonl；也可通过MetricsServer以Prometheus文本格式读取
+    '''
+    STAGES = ('http', 'decode', 'resample', 'process', 'spectrum', 'save', 'write')
+
+    def __init__(self):
+        self.started = None  # 开始实验的时刻，用于估计手机当前的acc_time
+        self.ticks = 0  # 已处理的刷新次数
+        self.samples = 0  # 已处理的采样数（重采样后）
+        self.retries = 0  # 获取失败后的重试次数
+        self.totals = dict.fromkeys(self.STAGES, 0.0)  # 各阶段累计耗时，单位：秒
+        self.last = dict.fromkeys(self.STAGES, 0.0)  # 最近一次刷新各阶段的耗时
+        self.lag = 0.0  # 最近一次处理完成时，最后一个采样点落后于手机的时间
+        self.lock = threading.Lock()  # 采集线程和处理线程都会更新
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.totals[stage] += seconds
+            self.last[stage] = seconds
+
+    def tick(self, monitor, samples):
+        """记录一次处理完成，返回这次刷新的JSON记录"""
+        with self.lock:
+            self.ticks += 1
+            self.samples += samples
+            elapsed = monotonic() - self.started if self.started is not None else 0.0
+            self.lag = max(elapsed - float(monitor.raw_data_t[-1]), 0.0)
+            record = {
+                'time': strftime('%Y-%m-%d %H:%M:%S', gmtime()),
+                'tick': self.ticks,
+                'samples': samples,
+                'samples_per_second': self.samples / elapsed if elapsed else 0.0,
+                'lag': round(self.lag, 3),
+                'retries': self.retries,
+                'skipped': monitor.skipped,
+                'late': monitor.late,
+                'gaps': monitor.resampler.gaps,
+                'backlog': monitor.writer.queue.qsize(),
+                'write_errors': monitor.writer.errors,
+                'ms': {stage: round(seconds * 1000, 3) for stage, seconds in self.last.items()},
+            }
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+class MetricsServer:
+    '''
+    以Prometheus文本格式在http://127.0.0.1:端口/metrics提供各设备的计数和耗时，供监控系统采集并在监测点落后时报警
+    '''
+    def __init__(self, monitors, port, host='127.0.0.1'):
+        self.monitors = monitors
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}/metrics'
+
+    def text(self):
+        lines = []
+
+        def metric(name, kind, description, values):
+            lines.append(f'# HELP icp_{name} {description}')
+            lines.append(f'# TYPE icp_{name} {kind}')
+            for labels, value in values:
+                lines.append(f'icp_{name}{{{",".join(f"{key}={json.dumps(str(item))}" for key, item in labels.items())}}} {float(value)}')
+
+        devices = [({'device': monitor.name or '1', 'ip': monitor.ip}, monitor) for monitor in self.monitors]
+        metric('ticks_total', 'counter', '已处理的刷新次数', [(labels, monitor.metrics.ticks) for labels, monitor in devices])
+        metric('samples_total', 'counter', '已处理的采样数', [(labels, monitor.metrics.samples) for labels, monitor in devices])
+        metric('retries_total', 'counter', '获取失败后的重试次数', [(labels, monitor.metrics.retries) for labels, monitor in devices])
+        metric('skipped_ticks_total', 'counter', '因处理落后而跳过的获取次数', [(labels, monitor.skipped) for labels, monitor in devices])
+        metric('late_ticks_total', 'counter', '获取耗时超过一个节拍的次数', [(labels, monitor.late) for labels, monitor in devices])
+        metric('gaps_total', 'counter', '检测到的数据缺失次数', [(labels, monitor.resampler.gaps if monitor.resampler else 0) for labels, monitor in devices])
+        metric('stage_seconds_total', 'counter', '各阶段累计耗时（秒）', [(dict(labels, stage=stage), seconds) for labels, monitor in devices for stage, seconds in monitor.metrics.totals.items()])
+        metric('stage_last_seconds', 'gauge', '最近一次刷新各阶段的耗时（秒）', [(dict(labels, stage=stage), seconds) for labels, monitor in devices for stage, seconds in monitor.metrics.last.items()])
+        metric('lag_seconds', 'gauge', '最后处理的采样点落后于手机的时间（秒）', [(labels, monitor.metrics.lag) for labels, monitor in devices])
+        metric('write_errors_total', 'counter', '写入线程写入失败的次数', [(labels, monitor.writer.errors if monitor.writer else 0) for labels, monitor in devices])
+        metric('writer_backlog', 'gauge', '写入线程队列中待写入的数据块数', [(labels, monitor.writer.queue.qsize() if monitor.writer else 0) for labels, monitor in devices])
+        metric('csis', 'gauge', '实时CSIS仪器烈度', [(labels, monitor.rt_ia_csis) for labels, monitor in devices])
+        metric('jma', 'gauge', '实时JMA计测震度', [(labels, monitor.rt_ia_jma) for labels, monitor in devices])
+        return '\n'.join(lines) + '\n'
+
+    def handler(self):
+        metrics_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics_server.text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+EVENTS_HEADER = ['Start (s)', 'End (s)', 'PGA (m/s^2)', 'PGA time (s)', 'PGV (m/s)', 'CSIS', 'JMA']
+
+
+class Monitor:
+    '''
+    实时监控一台设备\\
+    保存这台设备的日志文件夹、滤波与积分状态和各项最大值，同时监控多台设备时互不影响
+    name: 同时监控多台设备时的设备编号，用于区分日志文件夹和输出
+    '''
+    def __init__(self, ip, config, name=''):
+        self.ip = ip
+        self.config = config
+        self.name = name
+        self.label = f'[{name}] ' if name else ''
+        self.poller = PhyphoxPoller(ip, (config['timeout'], config['timeout']))
+        self.start_time = None  # 日志文件夹名
+        self.writer = None  # 日志写入线程
+        self.dashboard = None  # 网页波形，未启用时为None
+        self.metrics = Metrics()  # 各阶段耗时和计数
+        self.binary_header = None  # 二进制日志文件头，第一次处理数据后生成
+        self.skipped = 0  # 因处理落后而跳过的获取次数
+        self.late = 0  # 获取本身耗时超过一个节拍的次数
+        self.closed = False
+        self.last_latest_time = 0
+        self.is_measuring = True
+        self.sampling_rate = config['sampling_rate']
+        self.auto_correction = config['correction']['auto_correction']
+        self.correction = np.array((config['correction']['x'], config['correction']['y'], config['correction']['z']), dtype=float)  # 三方向基线校正值
+        self.resampler = None  # 逐块重采样，保存上一块的最后一个采样点和网格位置
+        self.stream_filter = None  # 流式滤波器，保存滤波和积分状态
+        self.jma_window = None  # 计算JMA标准烈度的滑动窗口
+        self.recent_max = {key: WindowMax(config['max_range']) for key in ('a', 'v', 'd', 'csis', 'jma')}  # 最近max_range次采样中的最大值
+        self.recent = None
+        self.trigger = None  # STA/LTA触发器，启用时在第一次处理时创建
+        self.pre_event = deque()  # 未触发时最近pre_event秒的原始数据，触发时一并处理
+        self.event = None  # 进行中事件的开始时刻和各项最大值
+        self.noise = None  # 未触发时本次刷新的噪声概况：(RMS, 峰值, STA/LTA)
+        self.magnitude = None  # 未触发时本次去掉平均值的原始合成加速度，供网页波形显示
+        self.spectrum_buffer = None  # 最近spectrum_window秒滤波后的三分向加速度
+        self.spectrum = None  # 在上述窗口上计算的(Sa, Sv, Sd)
+        self.indexes = [BlockIndex(span) for span in INDEX_FILES]  # 每秒、每分钟的分块摘要
+        self.rows = 0  # 已写入的处理后数据行数
+        self.epoch = None  # acc_time为0时的UTC时间戳
+        self.ia_csis, self.i_csis = 1.0, 1
+        self.ia_jma, self.i_jma = -3.0, 0
+        self.a_max, self.v_max, self.d_max = 0, 0, 0
+        self.a_max_time, self.v_max_time, self.d_max_time = 0, 0, 0
+        self.rt_a_max, self.rt_v_max, self.rt_d_max = 0, 0, 0
+        self.rt_ia_csis, self.rt_i_csis, self.rt_ia_jma, self.rt_i_jma = 0, 0, 0, 0
+
+    def connect(self):
+        """获取元数据并创建日志文件夹"""
+        self.start_time = get_meta(self.poller, self.name)
+        self.writer = LogWriter(f'./logs/{self.start_time}')
+        self.writer.start()
+
+    def start(self):
+        self.metrics.started = monotonic()  # 在请求前计时，估计的落后时间偏大而不会偏小
+        self.epoch = time()
+        self.poller.start()
+
+    def fetch(self):
+        """获取原始数据(5, N)，失败时重试，重试次数达限时抛出异常"""
+        retry_count = 0
+        while True:  # 重试循环
+            try:
+                self.last_latest_time, raw_data, self.is_measuring = analyse_raw_data(self.start_time, self.last_latest_time, self.poller)
+                self.metrics.add('http', self.poller.http_time)
+                self.metrics.add('decode', self.poller.decode_time)
+                return raw_data  # 如果获取成功，跳出重试循环
+            except Exception as e:  # 如果获取失败
+                if retry_count >= self.config['retry_limit']:  # 如果重试次数达限，抛出异常
+                    raise e
+                else:  # 否则进行下一次重试
+                    retry_count += 1
+                    self.metrics.retries += 1
+                    print(f'{self.label}原始数据获取失败，即将进行第{retry_count}次重试...\n----------')
+
+    def process(self, raw_data):
+        """处理获取的原始数据(5, N)，重采样后更新各项最大值，并交给写入线程存储"""
+        if not self.config['binary_log']:  # 在处理阶段交给写入线程：写入落后时阻塞的是处理，采集线程照常按节拍获取
+            self.writer.put_csv('Raw Data.csv', RAW_DATA_HEADER, raw_data.T)
+        if self.resampler is None:
+            if not self.sampling_rate:
+                self.sampling_rate = estimate_sampling_rate(raw_data[0])
+                print(f'{self.label}您没有设置采样率，程序自动测定的采样率为：{self.sampling_rate} Hz\n----------')
+            self.resampler = Resampler(self.sampling_rate)
+        start = perf_counter()
+        raw_data = self.resampler.process(raw_data)
+        self.metrics.add('resample', perf_counter() - start)
+        if raw_data.shape[1] == 0:  # 本次没有新的网格点
+            return
+        start = perf_counter()
+        trigger = self.config['trigger']
+        if trigger['enabled']:
+            if self.trigger is None:
+                self.trigger = StaLtaTrigger(self.sampling_rate, trigger['sta'], trigger['lta'], trigger['on'], trigger['off'], trigger['post_event'])
+            was_active = self.trigger.active
+            if not self.trigger.update(raw_data[1:4]) and not was_active:  # 安静：只统计噪声，不进行滤波、积分和烈度计算
+                self.quiet(raw_data, trigger['pre_event'])
+                self.metrics.add('process', perf_counter() - start)
+                if self.dashboard is not None:
+                    self.dashboard.push(self)
+                self.writer.put_text('Metrics.jsonl', self.metrics.tick(self, raw_data.shape[1]))
+                return
+            if not was_active:  # 事件开始：从前置缓冲的数据开始，以新的滤波和积分状态处理
+                raw_data = np.concatenate(list(self.pre_event) + [raw_data], axis=1)
+                self.pre_event.clear()
+                self.stream_filter, self.jma_window = None, None
+                self.event = {'start': float(raw_data[0, 0]), 'pga': 0.0, 'pga_time': 0.0, 'pgv': 0.0, 'csis': 1.0, 'jma': -3.0}
+                print(f'{self.label}STA/LTA触发（{round(self.trigger.ratio, 2)}），事件开始于{round(self.event["start"], 2)}s。\n----------')
+        self.noise = None
+        self.sampling_rate, self.auto_correction, self.stream_filter, self.jma_window, self.raw_data_t, self.waves, self.resultants, self.a_max, self.v_max, self.ia_csis, self.i_csis, self.ia_jma, self.i_jma, self.rt_a_max, self.rt_v_max, self.rt_ia_csis, self.rt_i_csis, self.rt_ia_jma, self.rt_i_jma, self.a_max_time, self.v_max_time, self.d_max, self.rt_d_max, self.d_max_time = main_process('0', raw_data, self.sampling_rate, self.auto_correction, self.stream_filter, self.jma_window, self.correction, self.a_max, self.v_max, self.a_max_time, self.v_max_time, self.ia_csis, self.i_csis, self.ia_jma, self.i_jma, self.d_max, self.d_max_time)
+        self.recent = update_recent_max(self.recent_max, self.raw_data_t, self.resultants, self.rt_ia_csis, self.rt_ia_jma)
+        if self.event is not None:
+            self.update_event()
+        self.metrics.add('process', perf_counter() - start)
+        if self.config['spectrum_window']:
+            start = perf_counter()
+            self.update_spectrum()
+            self.metrics.add('spectrum', perf_counter() - start)
+        if self.dashboard is not None:
+            self.dashboard.push(self)
+        start = perf_counter()
+        self.save(raw_data)
+        self.metrics.add('save', perf_counter() - start)
+        self.metrics.add('write', self.writer.write_time - self.metrics.totals['write'])  # 写入线程自上次以来的写入耗时
+        self.writer.put_text('Metrics.jsonl', self.metrics.tick(self, raw_data.shape[1]))
+
+    def quiet(self, raw_data, pre_event):
+        '''
+        未触发时的处理：计算噪声概况，推进“最近”最大值的窗口，并把数据留在前置缓冲中\\
+        实时PGA改为噪声峰值，实时烈度复位为初始值，不再保留上次事件的值，网页波形和监控指标随之更新
+        '''
+        self.raw_data_t = raw_data[0]
+        if self.auto_correction:  # 以第一次未触发的数据计算自动基线校正，不会把触发时的震动算入基线
+            self.correction = raw_data[1:4].mean(axis=1)
+            print(f'{self.label}自动基线校正结果：\nX方向：{self.correction[0]}\nY方向：{self.correction[1]}\nZ方向：{self.correction[2]}\n----------')
+            self.auto_correction = False
+        acc = raw_data[1:4] - raw_data[1:4].mean(axis=1, keepdims=True)  # 去掉本次的平均值，与基线校正无关
+        magnitude = np.sqrt(np.einsum('ij,ij->j', acc, acc))
+        self.noise = (float(np.sqrt(np.mean(magnitude * magnitude))), float(magnitude.max()), self.trigger.ratio)
+        self.magnitude = magnitude
+        self.rt_a_max, self.rt_v_max, self.rt_d_max = self.noise[1], 0, 0
+        self.rt_ia_csis, self.rt_i_csis, self.rt_ia_jma, self.rt_i_jma = 0, 0, 0, 0  # 未滤波的噪声不计算烈度
+        for window in self.recent_max.values():  # 安静期间没有新的最大值，只让旧的数据移出窗口
+            window.update(np.zeros(0), np.zeros(0), raw_data.shape[1])
+        self.pre_event.append(raw_data)
+        while sum(chunk.shape[1] for chunk in self.pre_event) - self.pre_event[0].shape[1] >= pre_event * self.sampling_rate:
+            self.save_raw(self.pre_event.popleft())
+
+    def save_raw(self, raw_data):
+        '''
+        存储未经处理的原始数据：使用二进制日志时，移出前置缓冲的数据以处理后各列为NaN的行写入，使二进制日志仍包含全部原始数据\\
+        触发时处理的前置缓冲数据则由save写入完整的行，因此每个采样点只写入一次。CSV日志的Raw Data.csv在每次刷新时已经写入
+        '''
+        if not self.config['binary_log']:
+            return
+        if self.binary_header is None:
+            self.binary_header = binary_log_header(self.sampling_rate, self.correction)
+        n = raw_data.shape[1]
+        self.writer.put_binary(self.binary_header, binary_log_rows(raw_data, np.full((3, 3, n), np.nan), np.full((3, n), np.nan)))
+        self.rows += n
+
+    def update_event(self):
+        """更新进行中事件的最大值；触发结束时将事件写入Events.csv"""
+        event = self.event
+        index = int(self.resultants[0].argmax())
+        if self.resultants[0, index] > event['pga']:
+            event['pga'], event['pga_time'] = float(self.resultants[0, index]), float(self.raw_data_t[index])
+        event['pgv'] = max(event['pgv'], float(self.resultants[1].max()))
+        event['csis'] = max(event['csis'], self.rt_ia_csis)
+        event['jma'] = max(event['jma'], self.rt_ia_jma)
+        if not self.trigger.active:
+            end = float(self.raw_data_t[-1])
+            self.writer.put_csv('Events.csv', EVENTS_HEADER, np.array([[event['start'], end, event['pga'], event['pga_time'], event['pgv'], event['csis'], event['jma']]]))
+            print(f'{self.label}事件结束于{round(end, 2)}s：PGA {round(event["pga"], 4)} m/s²（{round(event["pga_time"], 2)}s时刻），PGV {round(event["pgv"], 4)} m/s，CSIS {event["csis"]}，JMA {event["jma"]}\n----------')
+            self.event = None
+
+    def update_spectrum(self):
+        """把本次滤波后的三分向加速度追加到最近spectrum_window秒的缓冲区，并在整个窗口上重新计算反应谱"""
+        if self.spectrum_buffer is None:
+            self.spectrum_buffer = RingBuffer(3, max(int(self.config['spectrum_window'] * self.sampling_rate), 1))
+        self.spectrum_buffer.append(self.waves[0])
+        self.spectrum = response_spectrum(self.spectrum_buffer.snapshot(), self.sampling_rate, damping=self.config['spectrum_damping'])
+
+    def spectrum_peak(self):
+        """最近窗口反应谱中三分向最大的Sa及其周期，未启用时为None"""
+        if self.spectrum is None:
+            return None
+        sa = self.spectrum[0].max(axis=0)
+        index = int(sa.argmax())
+        return round(float(sa[index]), 4), round(float(SPECTRUM_PERIODS[index]), 3)
+
+    def save(self, raw_data):
+        """存储处理后数据，并更新分块摘要索引"""
+        if self.config['binary_log']:
+            if self.binary_header is None:
+                self.binary_header = binary_log_header(self.sampling_rate, self.correction)
+            self.writer.put_binary(self.binary_header, binary_log_rows(raw_data, self.waves, self.resultants))
+        else:
+            for data_type, wave, resultant in zip(('a', 'v', 'd'), self.waves, self.resultants):
+                file_type, header = processed_data_header(data_type)
+                file_name = f'Processed Data ({file_type}).csv'
+                self.writer.put_csv(file_name, header, np.vstack((self.raw_data_t, wave, resultant)).T, offsets_file(file_name))
+        for index in self.indexes:
+            self.save_index(index, index.update(self.raw_data_t, self.resultants, self.rows, self.rt_ia_csis, self.rt_ia_jma))
+        self.rows += len(self.raw_data_t)
+
+    def save_index(self, index, blocks):
+        if len(blocks):
+            header = binary_file_header(INDEX_MAGIC, {'span': index.span, 'epoch': self.epoch, 'binary_log': self.config['binary_log'], 'columns': INDEX_COLUMNS})
+            self.writer.put_binary(header, blocks, INDEX_FILES[index.span])
+
+    def print_result(self):
+        enable_pgd = self.config['enable_pgd']
+        recent = self.recent
+        print(strftime('/// %Y-%m-%d %H:%M:%S', gmtime()) + ' (UTC) ///')
+        if self.noise is not None:  # 未触发，只输出噪声概况
+            print(f'未触发：噪声RMS {round(self.noise[0], 4)} m/s²，峰值 {round(self.noise[1], 4)} m/s²，STA/LTA {round(self.noise[2], 2)}')
+            print(f'本次记录最大烈度：CSIS: {self.ia_csis} ({self.i_csis})，JMA: {self.ia_jma} ({format_i_jma(self.i_jma)})')
+            print('----------')
+            return
+        print(f'实时PGA：{round(self.rt_a_max,4)} m/s²')
+        print(f'实时PGV：{round(self.rt_v_max,4)} m/s')
+        if enable_pgd:
+            print(f'实时PGD：{round(self.rt_d_max, 4)} m')
+        print(f'实时烈度：\nCSIS: {self.rt_ia_csis} ({self.rt_i_csis})\nJMA: {self.rt_ia_jma} ({format_i_jma(self.rt_i_jma)})')
+        print(f'最近最大PGA：{round(recent["a"][0],4)} m/s²（{recent["a"][1]}s时刻）')
+        print(f'最近最大PGV：{round(recent["v"][0],4)} m/s（{recent["v"][1]}s时刻）')
+        if enable_pgd:
+            print(f'最近最大PGD：{round(recent["d"][0], 4)} m（{recent["d"][1]}s时刻）')
+        peak = self.spectrum_peak()
+        if peak is not None:
+            print(f'最近{self.config["spectrum_window"]}秒反应谱最大Sa：{peak[0]} m/s²（周期{peak[1]}s）')
+        print(f'最近最大烈度：\nCSIS: {recent["csis"][0]} ({csis_scale(recent["csis"][0])})（{recent["csis"][1]}s时刻）\nJMA: {recent["jma"][0]} ({format_i_jma(jma_scale(recent["jma"][0]))})（{recent["jma"][1]}s时刻）')
+        print(f'本次记录最大PGA：{round(self.a_max,4)} m/s²（{self.a_max_time}s时刻）')
+        print(f'本次记录最大PGV：{round(self.v_max,4)} m/s（{self.v_max_time}s时刻）')
+        if enable_pgd:
+            print(f'本次记录最大PGD：{round(self.d_max, 4)} m（{self.d_max_time}s时刻）')
+        print(f'本次记录最大烈度：\nCSIS: {self.ia_csis} ({self.i_csis})\nJMA: {self.ia_jma} ({format_i_jma(self.i_jma)})')
+        if self.resampler is not None and self.resampler.gaps:
+            print(f'数据缺失：{self.resampler.gaps}处，共{round(self.resampler.gap_time, 2)}秒（已插值补齐）')
+        if self.skipped or self.late or self.writer.queue.qsize() > self.writer.queue.maxsize // 2:
+            print(f'待写入：{self.writer.queue.qsize()}，因处理落后跳过获取：{self.skipped}次，获取超时：{self.late}次')
         print('----------')
-        sleep(config['delay'])
+
+    def acquire(self, refresh_time, raw_queue):
+        '''
+        采集阶段：按固定节拍获取数据放入有界队列raw_queue，在单独的线程中运行\\
+        队列满（处理或存储落后）时跳过本次获取，下次获取会从上回的位置一并取回这段数据，因此不会丢失数据，节拍也不会被拉长；
+        获取失败时放入异常，实验停止时放入None
+        '''
+        next_tick = monotonic()
+        while not self.closed:
+            next_tick += refresh_time
+            sleep(max(0, next_tick - monotonic()))
+            if self.closed:
+                return
+            if raw_queue.full():
+                self.skipped += 1
+                continue
+            try:
+                raw_data = self.fetch()
+            except Exception as e:
+                raw_queue.put(e)
+                return
+            if not self.is_measuring:
+                raw_queue.put(None)
+                return
+            raw_queue.put(raw_data)
+            if monotonic() - next_tick > refresh_time:  # 获取耗时超过一个节拍，从现在重新开始计时
+                self.late += 1
+                next_tick = monotonic()
+
+    def close(self):
+        self.closed = True
+        self.poller.close()
+        if self.writer is not None:
+            while self.pre_event:  # 未触发而留在前置缓冲中的数据
+                self.save_raw(self.pre_event.popleft())
+            for index in self.indexes:  # 最后一块
+                self.save_index(index, index.close())
+            self.writer.close()
+
+
+def print_summary(monitors, running):
+    """打印多台设备的汇总：各设备的实时值和全部设备中的最大烈度"""
+    print(strftime('/// %Y-%m-%d %H:%M:%S', gmtime()) + ' (UTC) 多设备汇总 ///')
+    for monitor, is_running in zip(monitors, running):
+        state = '' if is_running else '（已停止）'
+        print(f'{monitor.label}{monitor.ip}{state}：PGA {round(monitor.rt_a_max,4)} m/s²，CSIS {monitor.rt_ia_csis} ({monitor.rt_i_csis})，JMA {monitor.rt_ia_jma} ({format_i_jma(monitor.rt_i_jma)})')
+    csis_monitor = max(monitors, key=lambda monitor: monitor.ia_csis)
+    jma_monitor = max(monitors, key=lambda monitor: monitor.ia_jma)
+    print(f'全部设备本次记录最大烈度：\nCSIS: {csis_monitor.ia_csis} ({csis_monitor.i_csis})（{csis_monitor.label.strip()}）\nJMA: {jma_monitor.ia_jma} ({format_i_jma(jma_monitor.i_jma)})（{jma_monitor.label.strip()}）')
+    print('----------')
+
+
+async def monitor_devices(monitors, refresh_time):
+    '''
+    同时监控多台设备\\
+    所有设备按同一节拍刷新，各设备的获取和处理在各自的线程中进行，一台设备变慢或重试时不会推迟其他设备；
+    落后超过一个节拍的设备跳过错过的节拍，保持与其他设备同相位
+    '''
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    running = [True] * len(monitors)
+
+    async def run(index, monitor):
+        tick = 0
+        while True:
+            current = int((loop.time() - start) / refresh_time)
+            if current > tick + 1:  # 上次获取和处理超过了一个节拍
+                monitor.skipped += current - tick - 1
+            tick = max(tick + 1, current)
+            await asyncio.sleep(start + tick * refresh_time - loop.time())
+            try:
+                raw_data = await asyncio.to_thread(monitor.fetch)
+            except Exception as e:  # 重试次数达限，停止这台设备
+                print(f'{monitor.label}原始数据获取失败：{e}\n该设备的记录已终止。\n----------')
+                break
+            if not monitor.is_measuring:
+                print(f'{monitor.label}实验停止了？该设备的记录已终止。\n----------')
+                break
+            await asyncio.to_thread(monitor.process, raw_data)
+        running[index] = False
+
+    tasks = [asyncio.create_task(run(index, monitor)) for index, monitor in enumerate(monitors)]
+    tick = 0
+    while any(running):
+        tick += 1
+        await asyncio.sleep(start + (tick + 0.5) * refresh_time - loop.time())  # 在两次刷新之间输出，使用各设备最近一次的结果
+        print_summary(monitors, running)
+    await asyncio.gather(*tasks)
+
+
+def apply_overrides(config, overrides):
+    """将命令行中的KEY=VALUE覆盖到配置上，KEY可用.表示嵌套（如correction.x），VALUE按JSON解析，解析失败时作为字符串"""
+    for override in overrides:
+        key, separator, value = override.partition('=')
+        if not separator:
+            raise ValueError(f'无法识别的配置覆盖：{override}，应为KEY=VALUE')
         try:
-            get(ip+'/control?cmd=start')
-        except Exception as e:
-            throw_an_error(e, True)
-        is_recording = True
-        print(f'实验开始！')
-        print('----------')
+            value = json.loads(value)
+        except ValueError:
+            pass
+        *parents, name = key.split('.')
+        target = config
+        for parent in parents:
+            target = target[parent]
+        if name not in target:
+            raise KeyError(f'config.json中没有这一项：{key}')
+        target[name] = value
+    return config
+
+
+def live_mode(config, ip):
+    """实时监控模式，ip为逗号分隔的字符串或列表；返回退出码：实验停止时为0，获取失败而终止或有数据写入失败时为1"""
+    threading.Thread(target=import_module, args=('scipy.signal',), daemon=True).start()  # 在连接和等待期间预先导入滤波所需的scipy
+    refresh_time = config['refresh_time']
+    correction = config['correction']
+    ips = [format_ip(i) for i in (ip if isinstance(ip, list) else ip.split(',')) if i.strip()]
+
+    # 元数据获取
+    monitors = [Monitor(i, config, str(index + 1) if len(ips) > 1 else '') for index, i in enumerate(ips)]
+    for monitor in monitors:
+        monitor.connect()
+    dashboard = None
+    if config['dashboard_port']:
+        dashboard = Dashboard(int(config['dashboard_port']), config['dashboard_window']).start()
+        for monitor in monitors:
+            monitor.dashboard = dashboard
+    metrics_server = MetricsServer(monitors, int(config['metrics_port'])).start() if config['metrics_port'] else None
 
-        # 主循环
-        while is_recording:
-            sleep(refresh_time)
-            # 重置基线校正后和滤波后数据序列
-            corrected_ax = []  # 基线校正后x方向加速度数据序列
-            corrected_ay = []
-            corrected_az = []
-            ax = []  # 滤波后加速度x方向数据序列
-            ay = []
-            az = []
-            aa = []
-            vx = []  # 滤波后速度
-            vy = []
-            vz = []
-            va = []
-            dx = []  # 滤波后位移
-            dy = []
-            dz = []
-            da = []
-            #print(analyse_raw_data(start_time,0,ip))
+    # 开始实验
+    print('----------')
+    print(f'参数预览：\nIP地址：{", ".join(ips)}\n重试限制：{config["retry_limit"]}\n超时：{config["timeout"]} s\n刷新间隔：{refresh_time} s\n采样率：{config["sampling_rate"]} Hz\n计算CSIS标准烈度时参考PGV：{config["csis_v"]}\n计算JMA标准烈度时使用累计超过0.3秒的加速度：{config["jma_0.3"]}\n“最近”最大PGA、PGV和烈度指代的时间间隔：过去{config["max_range"]}次采样\n显示PGD（实验性）：{config["enable_pgd"]}\n使用二进制日志：{config["binary_log"]}\n网页波形：{dashboard.url if dashboard else False}\n监控指标：{metrics_server.url if metrics_server else False}\n加速度基线校正(x,y,z)：{correction["x"]}m/s²,{correction["y"]}m/s²,{correction["z"]}m/s²')
+    print(f'实验将在{config["delay"]}秒后自动开始，您不需在app上设置启动延迟...')
+    print('----------')
+    sleep(config['delay'])
+    try:
+        for monitor in monitors:
+            monitor.start()
+    except Exception as e:
+        throw_an_error(f'{e}', True)
+    print(f'实验开始！')
+    print('----------')
+
+    exit_code = 0
+    if len(monitors) > 1:
+        asyncio.run(monitor_devices(monitors, refresh_time))
+    else:
+        # 主循环：采集线程按固定节拍获取数据，主线程处理，写入线程存储，三者之间以有界队列连接
+        monitor = monitors[0]
+        raw_queue = Queue(maxsize=4)
+        threading.Thread(target=monitor.acquire, args=(refresh_time, raw_queue), daemon=True).start()
+        while True:
+            raw_data = raw_queue.get()
 
             # 原始数据获取
-            retry_count = 0
-            rt_a_max, rt_ia_csis, rt_i_csis, rt_ia_jma, rt_i_jma = 0,0,0,0,0
-            try:
-                while True:  # 重试循环
-                    try:
-                        last_latest_time, raw_data_t, raw_data_x, raw_data_y, raw_data_z, raw_data_a, is_measuring = analyse_raw_data(start_time,last_latest_time,ip)
-                        break  # 如果获取成功，跳出重试循环
-                    except Exception as e:  # 如果获取失败
-                        if retry_count >= config['retry_limit']:  # 如果重试次数达限，抛出异常
-                            raise e
-                        else:  # 否则进行下一次重试
-                            retry_count += 1
-                            print(f'原始数据获取失败，即将进行第{retry_count}次重试...\n----------')
-                            continue
-            except Exception as e:  # 捕获因重试次数达限抛出的异常，直接跳出大循环
-                print(f'原始数据获取失败：{e}\n记录已终止。\n----------')
-                #raise e
+            if isinstance(raw_data, Exception):  # 重试次数达限，直接跳出大循环
+                print(f'原始数据获取失败：{raw_data}\n记录已终止。\n----------')
+                exit_code = 1
                 break
 
             # 判断实验是否停止
-            if not is_measuring:
+            if raw_data is None:
                 print('实验停止了？记录已终止。\n----------')
                 break
 
-            sampling_rate, auto_correction, last_latest_vx, last_latest_vy, last_latest_vz, last_latest_time, a_max, v_max, ia_csis, i_csis, ia_jma, i_jma, rt_a_max, rt_v_max, rt_ia_csis, rt_i_csis, rt_ia_jma, rt_i_jma, a_max_time, v_max_time, last_latest_dx, last_latest_dy, last_latest_dz, d_max, rt_d_max, d_max_time = main_process(choice, False, sampling_rate, auto_correction, last_latest_vx, last_latest_vy, last_latest_vz, a_max, v_max, a_max_time, v_max_time, ia_csis, i_csis, ia_jma, i_jma, correction_x, correction_y, correction_z, last_latest_dx, last_latest_dy, last_latest_dz, d_max, d_max_time)
+            monitor.process(raw_data)
 
             # 结果输出
-            print(strftime('/// %Y-%m-%d %H:%M:%S', gmtime()) + ' (UTC) ///')
-            print(f'实时PGA：{round(rt_a_max,4)} m/s²')
-            print(f'实时PGV：{round(rt_v_max,4)} m/s')
-            if enable_pgd:
-                print(f'实时PGD：{round(rt_d_max, 4)} m')
-            print(f'实时烈度：\nCSIS: {rt_ia_csis} ({rt_i_csis})\nJMA: {rt_ia_jma} ({format_i_jma(rt_i_jma)})')
-            print(f'本次记录最大PGA：{round(a_max,4)} m/s²（{a_max_time}s时刻）')
-            print(f'本次记录最大PGV：{round(v_max,4)} m/s（{v_max_time}s时刻）')
-            if enable_pgd:
-                print(f'本次记录最大PGD：{round(d_max, 4)} m（{d_max_time}s时刻）')
-            print(f'本次记录最大烈度：\nCSIS: {ia_csis} ({i_csis})\nJMA: {ia_jma} ({format_i_jma(i_jma)})')
-            print('----------')
+            monitor.print_result()
             # TODO: 完成-处理实验手动停止/连接断开时的应对方法（跳出循环开始统计）
-            # TODO: 放弃-实时图象
+            # TODO: 完成-实时图象（网页波形）
             # TODO: 完成-终止后统计
             # TODO: 完成-又忘了做采样率自动分析了（以上2.17）
             # TODO: 完成-手动基线校正 未完成-自动
             # TODO: 完成-手动采样率设置 完成-自动
             # TODO: 完成-PGV转换
 
-        print(f'实验数据已经存储至logs/{start_time}。您可以进入数据分析模式查看波形。\n----------')
-    elif choice == '1':
-        corrected_ax = []  # 基线校正后x方向加速度数据序列
-        corrected_ay = []
-        corrected_az = []
-        ax = []  # 滤波后加速度x方向数据序列
-        ay = []
-        az = []
-        aa = []
-        vx = []  # 滤波后速度
-        vy = []
-        vz = []
-        va = []
-        dx = []  # 滤波后位移
-        dy = []
-        dz = []
-        da = []
-
-        path = input('----------\n请输入记录文件夹路径：').removeprefix('"').removesuffix('"').removesuffix('/').removesuffix(sep)
+    if dashboard is not None:
+        dashboard.close()
+    if metrics_server is not None:
+        metrics_server.close()
+    for monitor in monitors:
+        monitor.close()
+        if monitor.writer.errors:
+            print(f'{monitor.label}有{monitor.writer.errors}块数据写入失败，最后一次：{monitor.writer.last_error}\n----------')
+            exit_code = 1
+        print(f'{monitor.label}实验数据已经存储至logs/{monitor.start_time}。您可以进入数据分析模式查看波形。\n----------')
+    return exit_code
 
-        try:
-            open(path+'/Raw Data.csv', 'r')
-        except FileNotFoundError as e:
-            throw_an_error(f'文件不存在：{e}')
 
-        try:
-            open(path+'/Processed Data (Velocity).csv')
-            open(path + '/Processed Data (Displacement).csv')
-        except FileNotFoundError:
-            print('----------\n这个文件夹中只有原始数据，因此将开始从头分析。\n----------')
-            processed = False
+def analysis_mode(config, path, show=True, plot_path=None):
+    """数据分析模式：分析记录文件夹path并打印结果；show为真时显示图象，plot_path不为空时将图象保存到该路径"""
+    sampling_rate = config['sampling_rate']
+    analysis_block = config['analysis_block']
+    correction = np.array((config['correction']['x'], config['correction']['y'], config['correction']['z']), dtype=float)  # 三方向基线校正值
+
+    if detect_recording(path) is None:
+        throw_an_error(f'文件不存在：{path}/Raw Data.csv')
+    if config['correction']['auto_correction']:
+        print('----------\n数据分析模式下，自动基线校正不可用。\n----------')
+    cache = ResultCache(limit=config['cache_size'] * 2 ** 20)
+    entry, raw_data_t, waves, resultants, summary = analyse_recording(path, sampling_rate, correction, analysis_block, cache)
+    sampling_rate = summary['sampling_rate']
+    a_max, a_max_time, v_max, v_max_time, d_max, d_max_time = (summary[key] for key in ('a_max', 'a_max_time', 'v_max', 'v_max_time', 'd_max', 'd_max_time'))
+    ia_csis, i_csis, ia_jma, i_jma = (summary[key] for key in ('ia_csis', 'i_csis', 'ia_jma', 'i_jma'))
+
+    # 打印结果
+    print(strftime('/// %Y-%m-%d %H:%M:%S', gmtime()) + ' (UTC) 产出结果 ///')
+    print(f'本次记录最大PGA：{a_max} m/s²（{a_max_time}s时刻）')
+    print(f'本次记录最大PGV：{v_max} m/s（{v_max_time}s时刻）')
+    if config['enable_pgd']:
+        print(f'本次记录最大PGD：{d_max} m（{d_max_time}s时刻）')
+    print(f'本次记录最大烈度：\nCSIS: {ia_csis} ({i_csis})\nJMA: {ia_jma} ({format_i_jma(i_jma)})')
+    print('----------')
+
+    # 计算反应谱
+    spectrum = None
+    if config['response_spectrum']:
+        spectrum_path = f'{entry}/Spectrum {config["spectrum_damping"]}.npy'  # 与处理后数据一同缓存
+        if os_path.exists(spectrum_path):
+            spectrum = tuple(np.load(spectrum_path))
         else:
-            print('----------\n这个文件夹中有处理后的数据，因此将直接开始绘图。注意：基线校正已被禁用。\n----------')
-            processed = True
-
-        if not processed:
-            with open(path+'/Raw Data.csv', 'r') as raw_data_file:  # 解析原数据
-                raw_data = csv.reader(raw_data_file, delimiter=',')
-                for row in raw_data:
-                    if row[0] == 'Time (s)':
-                        continue
-                    raw_data_t.append(float(row[0]))
-                    raw_data_x.append(float(row[1]))
-                    raw_data_y.append(float(row[2]))
-                    raw_data_z.append(float(row[3]))
-                    raw_data_a.append(float(row[4]))
-
-        sampling_rate, auto_correction, last_latest_vx, last_latest_vy, last_latest_vz, last_latest_time, a_max, v_max, ia_csis, i_csis, ia_jma, i_jma, rt_a_max, rt_v_max, rt_ia_csis, rt_i_csis, rt_ia_jma, rt_i_jma, a_max_time, v_max_time, last_latest_dx, last_latest_dy, last_latest_dz, d_max, rt_d_max, d_max_time = main_process(choice, processed, sampling_rate, auto_correction, last_latest_vx, last_latest_vy, last_latest_vz, a_max, v_max, a_max_time, v_max_time, ia_csis, i_csis, ia_jma, i_jma, correction_x, correction_y, correction_z, last_latest_dx, last_latest_dy, last_latest_dz, d_max, d_max_time)
-
-        # 打印结果
-        print(strftime('/// %Y-%m-%d %H:%M:%S', gmtime()) + ' (UTC) 产出结果 ///')
-        print(f'本次记录最大PGA：{a_max} m/s²（{a_max_time}s时刻）')
-        print(f'本次记录最大PGV：{v_max} m/s（{v_max_time}s时刻）')
-        if enable_pgd:
-            print(f'本次记录最大PGD：{d_max} m（{d_max_time}s时刻）')
-        print(f'本次记录最大烈度：\nCSIS: {ia_csis} ({i_csis})\nJMA: {ia_jma} ({format_i_jma(i_jma)})')
+            spectrum = response_spectrum(waves[0], sampling_rate, damping=config['spectrum_damping'], block=analysis_block)
+            np.save(spectrum_path, np.stack(spectrum))
+        sa = spectrum[0]
+        component, index = np.unravel_index(sa.argmax(), sa.shape)
+        save_spectrum(f'{path}/Response Spectrum.csv', SPECTRUM_PERIODS, *spectrum)
+        print(f'反应谱最大Sa：{round(float(sa[component, index]), 4)} m/s²（{"XYZ"[component]}方向，周期{round(float(SPECTRUM_PERIODS[index]), 3)}s），已存储至{path}/Response Spectrum.csv。\n----------')
+
+    # 绘制图象
+    if show or plot_path:
+        if not show:
+            import matplotlib
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        fig = plot_waves(raw_data_t, waves, resultants, a_max, a_max_time, v_max, v_max_time)
+        if plot_path:
+            fig.savefig(plot_path, dpi=150)
+            print(f'图象已保存至{plot_path}。\n----------')
+        if spectrum is not None:
+            fig = plot_spectrum(SPECTRUM_PERIODS, *spectrum, config['spectrum_damping'])
+            if plot_path:
+                spectrum_path = ' (Spectrum)'.join(os_path.splitext(plot_path))
+                fig.savefig(spectrum_path, dpi=150)
+                print(f'反应谱已保存至{spectrum_path}。\n----------')
+        if show:
+            plt.show()
+
+
+def export_mode(path):
+    try:
+        export_csv(path)
+    except FileNotFoundError as e:
+        throw_an_error(f'文件不存在：{e}')
+    print(f'----------\n已导出至{path}。\n----------')
+
+
+def query_mode(config, roots, start_text, end_text, show=False, plot_path=None):
+    '''
+    按时间段查询实时监控记录：只读取各记录的分块摘要索引，打印每个记录在这段时间内的最大PGA、PGV和烈度\\
+    show为真或plot_path不为空时，再读取PGA最大的记录在这段时间内的波形并绘图
+    '''
+    folders = find_indexed(roots)
+    if not folders:
+        throw_an_error('没有找到带有分块摘要索引的记录。')
+        return
+    found = []
+    for folder in folders:
+        epoch = load_index(folder, 60)[0]['epoch']
+        start, end = parse_time(start_text, epoch), parse_time(end_text, epoch)
+        result = query_index(folder, start, end)
+        if result is not None:
+            found.append((folder, epoch, start, end, result))
+
+    print(strftime('/// %Y-%m-%d %H:%M:%S', gmtime()) + ' (UTC) 查询结果 ///')
+    if not found:
+        print('这段时间内没有记录。\n----------')
+        return
+
+    def clock(epoch, t):
+        return strftime('%Y-%m-%d %H:%M:%S', gmtime(epoch + t))
+
+    for folder, epoch, start, end, result in found:
+        print(f'{folder}（{clock(epoch, start)} ~ {clock(epoch, end)}，{result["samples"]}个采样）')
+        print(f'最大PGA：{round(result["a_max"], 4)} m/s²（{clock(epoch, result["a_max_time"])}，{round(result["a_max_time"], 2)}s时刻），RMS {round(result["a_rms"], 4)} m/s²')
+        print(f'最大PGV：{round(result["v_max"], 4)} m/s（{clock(epoch, result["v_max_time"])}，{round(result["v_max_time"], 2)}s时刻）')
+        if config['enable_pgd']:
+            print(f'最大PGD：{round(result["d_max"], 4)} m（{clock(epoch, result["d_max_time"])}，{round(result["d_max_time"], 2)}s时刻）')
+        print(f'最大烈度：CSIS: {result["csis"]} ({csis_scale(result["csis"])})，JMA: {result["jma"]} ({format_i_jma(jma_scale(result["jma"]))})')
         print('----------')
 
-        # 绘制图象
-        # plt.plot(raw_data_t, data_x, linewidth=1, color='green')
-        # plt.plot(raw_data_t, data_y, linewidth=1, color='blue')
-        # plt.plot(raw_data_t, data_z, linewidth=1, color='yellow')
-        fig, ((ax00, ax01), (ax10, ax11)) = plt.subplots(2, 2, sharex=True, sharey=True)
-        plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']
-        plt.rcParams['axes.unicode_minus'] = False
-        ax00.set_xlabel("时间 (s)")
-        ax00.grid(True)
-        ax00.set_ylabel("三分向合成后加速度 (m/s²)")
-        ax00.plot(raw_data_t, aa, linewidth=1, color='blue')
-        if a_max_time == v_max_time:
-            ax00.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²\nPGV: {v_max}m/s)', (a_max_time, a_max))
-        else:
-            ax00.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²)', (a_max_time, a_max))
-            ax00.annotate(f'({v_max_time}s\nPGV: {v_max}m/s)', (v_max_time, v_max))
-        ax01.set_xlabel("时间 (s)")
-        ax01.grid(True)
-        ax01.set_ylabel("X方向加速度 (m/s²)")
-        ax01.plot(raw_data_t, ax, linewidth=1, color='blue')
-        if a_max_time == v_max_time:
-            ax01.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²\nPGV: {v_max}m/s)', (a_max_time, a_max))
-        else:
-            ax01.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²)', (a_max_time, a_max))
-            ax01.annotate(f'({v_max_time}s\nPGV: {v_max}m/s)', (v_max_time, v_max))
-        ax10.set_xlabel("时间 (s)")
-        ax10.grid(True)
-        ax10.set_ylabel("Y方向加速度 (m/s²)")
-        ax10.plot(raw_data_t, ay, linewidth=1, color='blue')
-        if a_max_time == v_max_time:
-            ax10.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²\nPGV: {v_max}m/s)', (a_max_time, a_max))
-        else:
-            ax10.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²)', (a_max_time, a_max))
-            ax10.annotate(f'({v_max_time}s\nPGV: {v_max}m/s)', (v_max_time, v_max))
-        ax11.set_xlabel("时间 (s)")
-        ax11.grid(True)
-        ax11.set_ylabel("Z方向加速度 (m/s²)")
-        ax11.plot(raw_data_t, az, linewidth=1, color='blue')
-        if a_max_time == v_max_time:
-            ax11.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²\nPGV: {v_max}m/s)', (a_max_time, a_max))
+    if show or plot_path:
+        folder, epoch, start, end, result = max(found, key=lambda item: item[4]['a_max'])
+        raw_data_t, waves, resultants = read_range(folder, result['first_row'], result['last_row'], start, end)
+        index = resultants.argmax(axis=1)
+        a_max, v_max = round(float(resultants[0, index[0]]), 4), round(float(resultants[1, index[1]]), 4)
+        a_max_time, v_max_time = round(float(raw_data_t[index[0]]), 2), round(float(raw_data_t[index[1]]), 2)
+        if not show:
+            import matplotlib
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        fig = plot_waves(raw_data_t, waves, resultants, a_max, a_max_time, v_max, v_max_time)
+        if plot_path:
+            fig.savefig(plot_path, dpi=150)
+            print(f'{folder}在这段时间内的图象已保存至{plot_path}。\n----------')
+        if show:
+            plt.show()
+
+
+def read_path(prompt):
+    return input(prompt).removeprefix('"').removesuffix('"').removesuffix('/').removesuffix(sep)
+
+
+if __name__ == '__main__':
+    version = 'v2.1.1-alpha.2'
+
+    # 命令行参数：不带子命令时进入交互模式
+    parser = argparse.ArgumentParser(description=f'Intensity Calculator for Phyphox {version}')
+    parser.add_argument('-c', '--config', default='config.json', help='配置文件路径，默认为config.json')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='覆盖配置项，可多次使用，如--set delay=0 --set correction.x=0.01')
+    parser.add_argument('--no-update-check', action='store_true', help='交互模式下不检查更新')
+    subparsers = parser.add_subparsers(dest='command')
+    live_parser = subparsers.add_parser('live', help='实时监控（不需交互）')
+    live_parser.add_argument('ip', nargs='*', help='手机上显示的IP地址，可以有多个；不提供时使用配置中的ip')
+    analyse_parser = subparsers.add_parser('analyse', help='分析一个记录文件夹（不需交互）')
+    analyse_parser.add_argument('path', help='记录文件夹路径')
+    analyse_parser.add_argument('--plot', metavar='FILE', help='将图象保存到此文件')
+    analyse_parser.add_argument('--show', action='store_true', help='打开图象窗口')
+    export_parser = subparsers.add_parser('export', help='将二进制日志导出为CSV（不需交互）')
+    export_parser.add_argument('path', help='记录文件夹路径')
+    batch_parser = subparsers.add_parser('batch', help='批量分析记录文件夹（不需交互）')
+    batch_parser.add_argument('roots', nargs='*', default=['./logs'], help='在这些文件夹（含子文件夹）中查找记录，默认为./logs')
+    batch_parser.add_argument('-o', '--output', default='summary.csv', help='汇总表路径，以.json结尾时输出JSON，否则输出CSV')
+    batch_parser.add_argument('-j', '--workers', type=int, help='同时分析的进程数，默认为CPU核数')
+    batch_parser.add_argument('--plot', action='store_true', help='将每个记录的图象保存到其文件夹中的Waveform.png')
+    query_parser = subparsers.add_parser('query', help='按时间段查询实时监控记录（不需交互）')
+    query_parser.add_argument('roots', nargs='*', default=['./logs'], help='在这些文件夹（含子文件夹）中查找记录，默认为./logs')
+    query_parser.add_argument('--from', dest='start', required=True, help='开始时刻：UTC时间“YYYY-MM-DD HH:MM[:SS]”或“HH:MM[:SS]”，或相对记录开始的秒数')
+    query_parser.add_argument('--to', dest='end', required=True, help='结束时刻，格式同--from')
+    query_parser.add_argument('--plot', metavar='FILE', help='将PGA最大的记录在这段时间内的图象保存到此文件')
+    query_parser.add_argument('--show', action='store_true', help='打开图象窗口')
+    args = parser.parse_args()
+
+    config = apply_overrides(get_config(args.config), args.set)
+    csis_v = config['csis_v']
+    jma_03 = config['jma_0.3']
+
+    init_folders()
+
+    if args.command is not None:  # 命令行模式：不检查更新，不等待输入
+        interactive = False
+        if args.command == 'live':
+            exit(live_mode(config, args.ip or config['ip']))
+        elif args.command == 'analyse':
+            analysis_mode(config, args.path.removesuffix('/').removesuffix(sep), args.show, args.plot)
+        elif args.command == 'export':
+            export_mode(args.path.removesuffix('/').removesuffix(sep))
+        elif args.command == 'query':
+            query_mode(config, args.roots, args.start, args.end, args.show, args.plot)
         else:
-            ax11.annotate(f'({a_max_time}s\nPGA: {a_max}m/s²)', (a_max_time, a_max))
-            ax11.annotate(f'({v_max_time}s\nPGV: {v_max}m/s)', (v_max_time, v_max))
+            batch_analyse(args.roots, args.output, config, args.workers, args.plot)
+        exit(0)
 
-        plt.show()
+    print(f'Intensity Calculator for Phyphox {version}\nby HanZero')
+    if not args.no_update_check:
+        threading.Thread(target=check_for_update, args=(version,), daemon=True).start()
+    print('\n输入序号进入相应模式：\n0 - 实时监控\n1 - 数据分析\n2 - 将二进制日志导出为CSV\n3 - 按时间段查询实时监控记录\n')
+    choice = input('>>> ')
+    if choice == '0':
+        # 请求IP
+        ip = config['ip']
+        if not ip:
+            ip = input('----------\n请输入手机上显示的IP地址（同时监控多台设备时用英文逗号分隔）：')
+        live_mode(config, ip)
+    elif choice == '1':
+        analysis_mode(config, read_path('----------\n请输入记录文件夹路径：'))
+    elif choice == '2':
+        export_mode(read_path('----------\n请输入记录文件夹路径：'))
+    elif choice == '3':
+        roots = [read_path('----------\n请输入记录所在的文件夹路径（直接回车为./logs）：') or './logs']
+        start = input('----------\n请输入开始时刻（UTC，如2024-01-01 03:12，或相对记录开始的秒数）：')
+        end = input('请输入结束时刻：')
+        query_mode(config, roots, start, end, True)
     else:
         throw_an_error('无法识别您输入的序号！', True)
 
@@ -0,0 +1,269 @@
+"""
+phyphox远程访问接口的本地替身，以及实时监控模式的端到端性能测试
+
+serve: 在本地回放记录好的Raw Data.csv，提供/meta、/get和/control接口，可设置采样率、时间戳抖动、丢点、响应延迟和请求失败
+bench: 在替身上无界面地运行实时监控，统计每次刷新的获取和处理耗时、每秒处理的采样数和落后于“手机”的时间
+
+用法：
+python phyphox_stub.py serve "logs/xxx/Raw Data.csv" --rate 200 --jitter 0.002 --drop 0.01
+python phyphox_stub.py bench "logs/xxx/Raw Data.csv" --rate 100 200 500 --duration 30 -o bench.json
+"""
+import argparse
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os import chdir, getcwd
+from queue import Queue
+from tempfile import TemporaryDirectory
+from time import monotonic, perf_counter, sleep
+from urllib.parse import urlparse, parse_qsl
+
+import numpy as np
+
+import main
+
+
+def synthetic_data(seconds=600, rate=100, seed=0):
+    """没有提供记录时使用的合成数据：噪声背景中每隔一段时间出现一次振动，形状为(3, N)"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    acc = 0.02 * rng.standard_normal((3, t.size))
+    for start in range(20, int(seconds), 120):
+        window = (t > start) & (t < start + 15)
+        envelope = np.sin(np.pi * (t[window] - start) / 15)
+        acc[0, window] += 0.8 * envelope * np.sin(2 * np.pi * 2.0 * t[window])
+        acc[1, window] += 0.5 * envelope * np.sin(2 * np.pi * 3.1 * t[window])
+        acc[2, window] += 0.3 * envelope * np.sin(2 * np.pi * 1.3 * t[window])
+    return acc
+
+
+class PhyphoxStub:
+    '''
+    回放加速度数据的phyphox替身\\
+    acc: 三方向加速度(3, N)，循环回放
+    rate: 回放的采样率，单位：Hz
+    jitter: 时间戳抖动的标准差，单位：秒
+    drop: 每个采样点丢失的概率（模拟Wi-Fi丢点，时间戳出现间隔）
+    latency: 每次响应前随机等待0~latency秒
+    fail: 每次/get请求失败（返回503）的概率
+    duration: 最长回放时间，单位：秒
+    '''
+    def __init__(self, acc, rate=100, jitter=0.0, drop=0.0, latency=0.0, fail=0.0, duration=3600, port=0, seed=0):
+        self.rate = rate
+        self.latency = latency
+        self.fail = fail
+        self.rng = np.random.default_rng(seed)
+        count = int(duration * rate)
+        t = np.arange(count) / rate
+        if jitter:
+            t += self.rng.normal(0, jitter, count)
+            t = np.maximum.accumulate(t)  # 时间戳仍单调
+        keep = self.rng.random(count) >= drop
+        self.data = np.empty((5, int(keep.sum())))
+        self.data[0] = t[keep]
+        self.data[1:4] = acc[:, np.arange(count) % acc.shape[1]][:, keep]
+        self.data[4] = np.sqrt((self.data[1:4] ** 2).sum(axis=0))
+        self.start_time = None  # 收到/control?cmd=start的时刻
+        self.stopped = False
+        self.requests = 0
+        self.failures = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.port = self.server.server_address[1]
+        self.ip = f'http://127.0.0.1:{self.port}'
+
+    def available(self):
+        """当前“手机”上已有的采样数"""
+        if self.start_time is None:
+            return 0
+        return int(np.searchsorted(self.data[0], monotonic() - self.start_time, side='right'))
+
+    def latest_time(self):
+        """当前“手机”上最新的acc_time"""
+        n = self.available()
+        return self.data[0, n - 1] if n else 0.0
+
+    def measuring(self):
+        return self.start_time is not None and not self.stopped and self.available() < self.data.shape[1]
+
+    def buffer(self, query):
+        n = self.available()
+        since = query.get('acc_time', '')
+        begin = int(np.searchsorted(self.data[0, :n], float(since), side='right')) if since else 0
+        columns = {'acc_time': 0, 'accX': 1, 'accY': 2, 'accZ': 3, 'acc': 4}
+        return {
+            'buffer': {key: {'size': 0, 'updateMode': 'partial', 'buffer': self.data[columns[key], begin:n].tolist()} for key in query if key in columns},
+            'status': {'session': 'stub', 'measuring': self.measuring(), 'timedRun': False, 'countDown': 0},
+        }
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # 支持保持连接
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, status=200):
+                body = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = dict(parse_qsl(url.query, keep_blank_values=True))
+                if stub.latency:
+                    sleep(stub.rng.uniform(0, stub.latency))
+                if url.path == '/meta':
+                    self.reply(json.dumps({'version': 'stub', 'deviceModel': 'phyphox_stub', 'rate': stub.rate}))
+                elif url.path == '/control':
+                    if query.get('cmd') == 'start':
+                        stub.start_time = monotonic()
+                        stub.stopped = False
+                    elif query.get('cmd') == 'stop':
+                        stub.stopped = True
+                    self.reply(json.dumps({'result': True}))
+                elif url.path == '/get':
+                    stub.requests += 1
+                    if stub.fail and stub.rng.random() < stub.fail:
+                        stub.failures += 1
+                        self.reply('{}', 503)
+                    else:
+                        self.reply(json.dumps(stub.buffer({key.split('=')[0]: value.split('|')[0] for key, value in query.items()})))
+                else:
+                    self.reply('{}', 404)
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def default_config(refresh_time):
+    """性能测试使用的配置：以config.json为基础，去掉启动延迟"""
+    try:
+        config = main.get_config()
+    except FileNotFoundError:
+        config = {'retry_limit': 3, 'timeout': 5, 'sampling_rate': '', 'csis_v': True, 'jma_0.3': True, 'max_range': 12000, 'enable_pgd': False, 'binary_log': False, 'dashboard_port': '', 'dashboard_window': 300, 'metrics_port': '', 'analysis_block': 1000000, 'cache_size': 1024, 'response_spectrum': True, 'spectrum_damping': 0.05, 'spectrum_window': '', 'trigger': {'enabled': False, 'sta': 1, 'lta': 30, 'on': 3.0, 'off': 1.5, 'pre_event': 10, 'post_event': 30}, 'correction': {'auto_correction': True, 'x': 0.0, 'y': 0.0, 'z': 0.0}}
+    config = dict(config, refresh_time=refresh_time, delay=0)
+    return config
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+def bench(stub, config, duration):
+    '''
+    在替身上无界面地运行实时监控duration秒，使用与实时监控模式相同的采集线程、处理和写入线程\\
+    返回每次刷新的获取耗时、处理耗时、采样数和落后时间的统计
+    '''
+    main.init_worker(config, False)
+    fetch_times = []
+
+    class TimedMonitor(main.Monitor):
+        def fetch(self):
+            start = perf_counter()
+            raw_data = super().fetch()
+            fetch_times.append(perf_counter() - start)
+            return raw_data
+
+    previous = getcwd()
+    with TemporaryDirectory() as folder:
+        chdir(folder)
+        main.init_folders()
+        monitor = TimedMonitor(stub.ip, config)
+        monitor.connect()
+        monitor.start()
+        raw_queue = Queue(maxsize=4)
+        threading.Thread(target=monitor.acquire, args=(config['refresh_time'], raw_queue), daemon=True).start()
+        process_times, samples, lags = [], [], []
+        begin = monotonic()
+        error = None
+        while monotonic() - begin < duration:
+            raw_data = raw_queue.get()
+            if raw_data is None or isinstance(raw_data, Exception):
+                error = None if raw_data is None else repr(raw_data)
+                break
+            start = perf_counter()
+            monitor.process(raw_data)
+            process_times.append(perf_counter() - start)
+            samples.append(raw_data.shape[1])
+            lags.append(stub.latest_time() - raw_data[0, -1])
+        elapsed = monotonic() - begin
+        stub.stopped = True
+        monitor.close()
+        chdir(previous)
+    return {
+        'rate': stub.rate,
+        'refresh_time': config['refresh_time'],
+        'ticks': len(process_times),
+        'samples_per_second': sum(samples) / elapsed,
+        'fetch_ms': {'mean': 1000 * float(np.mean(fetch_times or [0])), 'p95': 1000 * percentile(fetch_times, 95), 'max': 1000 * max(fetch_times or [0])},
+        'process_ms': {'mean': 1000 * float(np.mean(process_times or [0])), 'p95': 1000 * percentile(process_times, 95), 'max': 1000 * max(process_times or [0])},
+        'lag_s': {'mean': float(np.mean(lags or [0])), 'max': max(lags or [0])},
+        'skipped': monitor.skipped,
+        'late': monitor.late,
+        'writer_max_backlog': monitor.writer.max_backlog,
+        'writer_errors': monitor.writer.errors,
+        'requests': stub.requests,
+        'failures': stub.failures,
+        'error': error,
+    }
+
+
+def load_acc(file_path):
+    if file_path:
+        return main.load_csv(file_path)[1:4]
+    return synthetic_data()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='phyphox远程访问接口的本地替身与实时监控性能测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name in ('serve', 'bench'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('csv', nargs='?', help='回放的Raw Data.csv，不提供时使用合成数据')
+        sub.add_argument('--jitter', type=float, default=0.0, help='时间戳抖动的标准差（秒）')
+        sub.add_argument('--drop', type=float, default=0.0, help='采样点丢失的概率')
+        sub.add_argument('--latency', type=float, default=0.0, help='每次响应前的最大随机延迟（秒）')
+        sub.add_argument('--fail', type=float, default=0.0, help='/get请求失败的概率')
+    subparsers.choices['serve'].add_argument('--rate', type=float, default=100, help='回放采样率（Hz）')
+    subparsers.choices['serve'].add_argument('--port', type=int, default=8080)
+    subparsers.choices['bench'].add_argument('--rate', type=float, nargs='+', default=[100, 200, 500], help='依次测试的采样率（Hz）')
+    subparsers.choices['bench'].add_argument('--duration', type=float, default=30, help='每个采样率的测试时长（秒）')
+    subparsers.choices['bench'].add_argument('--refresh', type=float, default=1, help='刷新间隔（秒）')
+    subparsers.choices['bench'].add_argument('-o', '--output', help='将结果保存为JSON')
+    args = parser.parse_args()
+    acc = load_acc(args.csv)
+
+    if args.command == 'serve':
+        stub = PhyphoxStub(acc, args.rate, args.jitter, args.drop, args.latency, args.fail, port=args.port).start()
+        print(f'phyphox替身已在{stub.ip}上运行，按Ctrl+C退出...')
+        try:
+            while True:
+                sleep(1)
+        except KeyboardInterrupt:
+            stub.close()
+    else:
+        results = []
+        for rate in args.rate:
+            stub = PhyphoxStub(acc, rate, args.jitter, args.drop, args.latency, args.fail, duration=args.duration + 60).start()
+            result = bench(stub, default_config(args.refresh), args.duration)
+            stub.close()
+            results.append(result)
+            print(f'{rate:g} Hz：{result["ticks"]}次刷新，{result["samples_per_second"]:.0f}采样/秒，'
+                  f'获取{result["fetch_ms"]["mean"]:.1f} ms（p95 {result["fetch_ms"]["p95"]:.1f}），'
+                  f'处理{result["process_ms"]["mean"]:.1f} ms（p95 {result["process_ms"]["p95"]:.1f}），'
+                  f'落后{result["lag_s"]["mean"]:.2f} s（最大{result["lag_s"]["max"]:.2f}），跳过{result["skipped"]}次')
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as output_file:
+                json.dump(results, output_file, ensure_ascii=False, indent=2)